@@ -1,7 +1,20 @@
+import asyncio
+import atexit
 import sqlite3
 import json
 import os
-from typing import Dict, List, Any, Optional
+import queue
+import threading
+import time
+import weakref
+import orjson
+try:
+    import redis
+except ImportError:  # Optional, only needed with REDIS_URL (see _make_kv)
+    redis = None
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Any, Optional, Tuple
 from .game_world import game_world
 from .gemini_service import generate_item_details, generate_quest
 import logging
@@ -10,6 +23,167 @@ logger = logging.getLogger(__name__)
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "game_data.db")
 
+# Applied once to the shared connection. WAL with synchronous=NORMAL only fsyncs on checkpoint
+# instead of on every commit; the cache is 64 MiB and up to 256 MiB of the file is memory-mapped.
+# The WAL file is truncated back to 64 MiB after checkpoints so a burst of writes does not pin disk.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA journal_size_limit=67108864",
+)
+
+# Bumped whenever init_db gains a schema change or migration; stored in PRAGMA user_version
+SCHEMA_VERSION = 3
+
+# Statements on the challenge / stub hot paths. Kept as constants so the shared connection's
+# statement cache (see cached_statements in __init__) always sees the same SQL text.
+SQL_SELECT_CHALLENGE = '''
+    SELECT c.*, q.giver_npc FROM challenges c
+    LEFT JOIN quests q ON q.id = c.quest_id AND q.session_id = c.session_id
+    WHERE c.id = ? AND c.session_id = ?
+'''
+SQL_COMPLETE_CHALLENGE = '''
+    UPDATE challenges
+    SET completed = ?, result = ?, success = ?, severity = ?
+    WHERE id = ?
+    RETURNING quest_id
+'''
+SQL_COMPLETE_CHALLENGES = '''
+    UPDATE challenges
+    SET completed = ?, result = ?, success = ?, severity = ?
+    WHERE id = ?
+'''
+# The status <> filter skips the write entirely when the quest already has the outcome
+SQL_CLOSE_QUEST = '''
+    UPDATE quests
+    SET status = outcome.status
+    FROM (
+        SELECT CASE WHEN EXISTS(
+            SELECT 1 FROM challenges WHERE quest_id = :quest_id AND success = 0
+        ) THEN 'failed' ELSE 'completed' END AS status
+    ) AS outcome
+    WHERE quests.id = :quest_id
+      AND quests.status <> outcome.status
+      AND NOT EXISTS(SELECT 1 FROM challenges WHERE quest_id = :quest_id AND completed = 0)
+'''
+SQL_INSERT_CHALLENGE = '''
+    INSERT OR REPLACE INTO challenges (id, session_id, quest_id, type, dc, description, completed)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_ACCEPT_QUEST = "UPDATE quests SET status = 'active' WHERE id = ? AND session_id = ? RETURNING accept_response, giver_npc"
+SQL_REFUSE_QUEST = "UPDATE quests SET status = 'refused' WHERE id = ? AND session_id = ? RETURNING refuse_response, giver_npc"
+# Ids are passed as one JSON array so the statement text does not depend on how many there are
+SQL_SELECT_CHALLENGES = '''
+    SELECT c.*, q.giver_npc FROM challenges c
+    LEFT JOIN quests q ON q.id = c.quest_id AND q.session_id = c.session_id
+    WHERE c.session_id = ? AND c.id IN (SELECT value FROM json_each(?))
+'''
+# Quests shown to the player and to NPCs, and all of their challenges in one query
+SQL_SELECT_OPEN_QUESTS = "SELECT * FROM quests WHERE session_id = ? AND status IN ('active', 'completed', 'failed') ORDER BY rowid"
+SQL_SELECT_OPEN_QUEST_CHALLENGES = '''
+    SELECT c.* FROM challenges c
+    JOIN quests q ON q.id = c.quest_id
+    WHERE q.session_id = ? AND q.status IN ('active', 'completed', 'failed')
+    ORDER BY c.rowid
+'''
+SQL_SELECT_STUB_IDS = "SELECT id FROM entity_stubs WHERE session_id = ?"
+SQL_INSERT_STUB = '''
+    INSERT OR IGNORE INTO entity_stubs (id, session_id, name, type, status, needs_expansion)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# Entity stubs are written by a background thread in batches of up to STUB_BATCH_SIZE,
+# waiting at most STUB_FLUSH_INTERVAL seconds for a batch to fill
+STUB_BATCH_SIZE = 256
+STUB_FLUSH_INTERVAL = 0.05  # seconds
+
+# NPC state rows, one per (session, NPC). States are passed as a JSON object of name -> state.
+SQL_UPSERT_NPC_STATES = "INSERT OR REPLACE INTO npc_states (session_id, npc_name, state) SELECT ?, key, value FROM json_each(?)"
+SQL_SELECT_NPC_STATES = "SELECT json_group_object(npc_name, json(state)) FROM npc_states WHERE session_id = ?"
+# Clamped relationship change on one NPC row; NPCs without a row start from the default state
+SQL_ADJUST_RELATIONSHIP = '''
+    INSERT INTO npc_states (session_id, npc_name, state)
+    SELECT :session_id, :npc_name,
+           json_set(:default_state, '$.relationship',
+                    max(0, min(100, json_extract(:default_state, '$.relationship') + :modifier)))
+    WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = :session_id)
+    ON CONFLICT (session_id, npc_name) DO UPDATE SET state = json_set(
+        state, '$.relationship',
+        max(0, min(100, coalesce(json_extract(state, '$.relationship'), json_extract(:default_state, '$.relationship')) + :modifier)))
+    RETURNING state
+'''
+# Relationship before the adjustment above, for the log line; NULL if the NPC has no row yet
+SQL_SELECT_RELATIONSHIP = "SELECT json_extract(state, '$.relationship') FROM npc_states WHERE session_id = ? AND npc_name = ?"
+
+SQL_APPEND_CONVERSATION = '''
+    INSERT INTO conversation_history (session_id, turn_idx, role, content)
+    VALUES (?, (SELECT COALESCE(MAX(turn_idx), -1) + 1 FROM conversation_history WHERE session_id = ?), ?, ?)
+'''
+SQL_SELECT_CONVERSATION = "SELECT role, content FROM conversation_history WHERE session_id = ? ORDER BY turn_idx"
+
+# Scalar session columns that getters read on their own, without loading the whole session
+SESSION_SCALAR_FIELDS = (
+    'player_name', 'current_location_name', 'player_x', 'player_y',
+    'health', 'gold', 'conversation_partner', 'game_mode',
+)
+# The list, NPC and history columns on the row are left NULL by the migrations, so only scalars are read
+SQL_SELECT_SESSION = f"SELECT session_id, {', '.join(SESSION_SCALAR_FIELDS)} FROM sessions WHERE session_id = ?"
+SQL_SELECT_SESSION_SCALAR = {field: f"SELECT {field} FROM sessions WHERE session_id = ?" for field in SESSION_SCALAR_FIELDS}
+
+# With Redis, session rows are cached as JSON blobs keyed by "session:<id>" and dropped on every
+# write (see _make_kv and _store_session_blob); without it, decoded in process by a _SessionCache of SESSION_CACHE_SIZE sessions
+SESSION_CACHE_TTL = 1800  # seconds
+SESSION_CACHE_SIZE = 1024
+ACTIVE_SESSION_TTL = 10  # seconds, see get_active_session_id
+# List fields kept in their own tables, one row per entry: field -> (table, value column, order column)
+SESSION_LIST_TABLES = {
+    'inventory': ('inventory', 'item', 'slot'),
+    'quest_log': ('quest_log', 'quest', 'idx'),
+}
+SQL_SELECT_SESSION_LIST = {
+    field: f"SELECT {value_column} FROM {table} WHERE session_id = ? ORDER BY {order_column}"
+    for field, (table, value_column, order_column) in SESSION_LIST_TABLES.items()
+}
+SQL_APPEND_SESSION_LIST = {
+    field: f'''
+        INSERT INTO {table} (session_id, {order_column}, {value_column})
+        VALUES (?, (SELECT COALESCE(MAX({order_column}), -1) + 1 FROM {table} WHERE session_id = ?), ?)
+    '''
+    for field, (table, value_column, order_column) in SESSION_LIST_TABLES.items()
+}
+SQL_REMOVE_SESSION_LIST = {
+    field: f'''
+        DELETE FROM {table} WHERE rowid = (
+            SELECT rowid FROM {table} WHERE session_id = ? AND {value_column} = ?
+            ORDER BY {order_column} LIMIT 1
+        )
+    '''
+    for field, (table, value_column, order_column) in SESSION_LIST_TABLES.items()
+}
+
+# UPDATE statements keyed by the tuple of columns they set. Single-column statements are built up
+# front; multi-column combinations are added on first use so each one keeps a stable SQL string.
+SESSION_UPDATE_FIELDS = SESSION_SCALAR_FIELDS
+SQL_UPDATE_SESSION = {(field,): f"UPDATE sessions SET {field} = ? WHERE session_id = ?" for field in SESSION_UPDATE_FIELDS}
+
+SQL_SELECT_PLAYER_STATS = "SELECT strength, dexterity, intelligence, charisma FROM player_stats WHERE session_id = ?"
+DEFAULT_PLAYER_STATS = {"strength": 10, "dexterity": 10, "intelligence": 10, "charisma": 10}
+
+# Map offsets (dx, dy): the eight neighbours named in location descriptions, and the four moves
+ADJACENT_DIRECTIONS = {
+    "North": (0, -1), "South": (0, 1), "East": (1, 0), "West": (-1, 0),
+    "North-East": (1, -1), "North-West": (-1, -1), "South-East": (1, 1), "South-West": (-1, 1)
+}
+MOVE_DIRECTIONS = {"north": (0, -1), "south": (0, 1), "east": (1, 0), "west": (-1, 0)}
+
+# The three possible answers of should_require_roll, which depend only on stat - DC
+ROLL_AUTO_SUCCESS = {"requires_roll": False, "outcome": "auto_success", "narrative": "Trivial task."}
+ROLL_AUTO_FAILURE = {"requires_roll": False, "outcome": "auto_failure", "narrative": "Beyond your ability."}
+ROLL_UNCERTAIN = {"requires_roll": True, "outcome": "uncertain"}
+
 DEFAULT_NPC_STATE = {
     "mood": "content",
     "relationship": 50,
@@ -174,107 +348,394 @@ NPC_RESOURCE_LEVELS = {
     }
 }
 
+class _SessionCache:
+    """In-process cache of decoded sessions, used when there is no Redis.
+
+    Entries expire SESSION_CACHE_TTL seconds after they are loaded, like the Redis entries they
+    replace, and the least recently used session is dropped once there are SESSION_CACHE_SIZE.
+    get() hands back the stored dict itself so write-throughs can patch it in place. on_evict is
+    called with the id of every session that expires or is dropped for space (not for pop()).
+    """
+
+    def __init__(self, ttl: float = SESSION_CACHE_TTL, max_size: int = SESSION_CACHE_SIZE,
+                 on_evict: Callable[[str], None] | None = None):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._on_evict = on_evict
+        self._data: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Dict[str, Any] | None:
+        with self._lock:
+            entry = self._data.get(session_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at >= time.monotonic():
+                self._data.move_to_end(session_id)
+                return data
+            del self._data[session_id]
+        # Outside the lock: the callback takes the manager's lock, which is held around get() elsewhere
+        if self._on_evict is not None:
+            self._on_evict(session_id)
+        return None
+
+    def set(self, session_id: str, data: Dict[str, Any]):
+        evicted = []
+        with self._lock:
+            self._data[session_id] = (time.monotonic() + self._ttl, data)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self._max_size:
+                evicted.append(self._data.popitem(last=False)[0])
+        if self._on_evict is not None:
+            for evicted_id in evicted:
+                self._on_evict(evicted_id)
+
+    def pop(self, session_id: str):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+
+def _make_kv():
+    """Returns a Redis client if REDIS_URL is set, otherwise None (sessions use a _SessionCache)."""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        if redis is not None:
+            return redis.Redis.from_url(redis_url, decode_responses=True)
+        logger.warning("REDIS_URL is set but the redis package is not installed. Using in-process cache.")
+    return None
+
+
+def _session_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def _session_generation_key(session_id: str) -> str:
+    """Counter bumped by every write, so a reader can tell whether its SQLite snapshot is still current."""
+    return f"session:{session_id}:gen"
+
+
+def _copy_session_value(value: Any) -> Any:
+    """Copies the two container levels session fields use (npc_states, conversation turns)."""
+    if isinstance(value, list):
+        return [dict(v) if isinstance(v, dict) else v for v in value]
+    if isinstance(value, dict):
+        return {k: dict(v) if isinstance(v, dict) else v for k, v in value.items()}
+    return value
+
+
+def _fetch_dicts(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    """Materializes the pending result set as dicts without going through sqlite3.Row."""
+    cols = [d[0] for d in cursor.description]
+    return [dict(zip(cols, r)) for r in cursor]
+
+def _fetch_dict(cursor: sqlite3.Cursor) -> Optional[Dict[str, Any]]:
+    """Like _fetch_dicts, but for lookups that can match at most one row."""
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip((d[0] for d in cursor.description), row))
+
+
 class GameStateManager:
 
     def __init__(self):
+        # One long-lived connection shared by every caller. isolation_level=None keeps it in
+        # autocommit mode; the lock serializes access from FastAPI's worker threads.
+        self._conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
+        self._lock = threading.RLock()
+        for pragma in SQLITE_PRAGMAS:
+            self._conn.execute(pragma)
+        self._kv = _make_kv()
+        # Decoded sessions, so reads skip json.loads. Only used without Redis: with it, other
+        # workers may write the same session and the blob there is the source of truth.
+        self._session_cache: _SessionCache | None = (
+            _SessionCache(on_evict=self._forget_session) if self._kv is None else None)
+        # session_id -> (location_name, lowered npc name) -> npc_id, refreshed by sync_world_npcs
+        self._loc_name_index: Dict[str, Dict[Tuple[str, str], str]] = {}
+        # (expires_at, session_id) from the last get_active_session_id lookup
+        self._active_session: Tuple[float, str] | None = None
+        # npc_id -> (Character, its model_dump()), see get_npc_info
+        self._npc_info_cache: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+        # Sessions whose NPC states have been synced with game_world since startup (see sync_world_npcs)
+        self._synced_sessions: set[str] = set()
+        # game_world.generation the NPC indexes below were built for, see _check_world_generation
+        self._world_generation = game_world.generation
+        # session_id -> location -> (x, y) -> [(npc_states position, npc_id)], dropped whenever an NPC is added or moves
+        self._npc_grid: Dict[str, Dict[str, Dict[Tuple[int, int], List[Tuple[int, str]]]]] = {}
+        # session_id -> {lowered item name: item name}, dropped whenever the inventory is written
+        self._inventory_lower: Dict[str, Dict[str, str]] = {}
+        # Serializes commands per session; different sessions still run concurrently. Weak values, so
+        # a session's lock goes away once no command holds or waits on it.
+        self._session_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        # Exploration commands: exact matches are looked up first, then the prefixes in order.
+        # Every handler takes (session_id, argument) and is awaited.
+        self._command_handlers = {
+            "inventory": self._cmd_inventory,
+            "look": self._cmd_look,
+            "enter": self._cmd_enter,
+            "rumors": self._cmd_rumors,
+        }
+        self._prefix_handlers = (
+            ("go ", self._cmd_go),
+            ("talk to ", self._cmd_talk),
+            ("examine ", self._cmd_examine),
+            ("look ", self._cmd_examine),
+        )
         self.init_db()
-        print("GameStateManager initialized with SQLite.")
+        # (session_id, entity_id) pairs waiting for the stub writer, and the ids already queued per session
+        self._stub_queue: queue.Queue[Tuple[str, str] | None] = queue.Queue()
+        self._queued_stubs: Dict[str, set[str]] = {}
+        # session_id -> ids known to have a stub row, so repeat mentions skip the queue entirely.
+        # Filled from the table on a session's first stub check (see process_involved_entities).
+        self._stub_cache: Dict[str, set[str]] = {}
+        self._stub_writer = threading.Thread(target=self._run_stub_writer, name="entity-stub-writer", daemon=True)
+        self._stub_writer.start()
+        self._closed = False
+        atexit.register(self.close)
+        logger.info("GameStateManager initialized with SQLite.")
+
+    def close(self):
+        """Writes any queued stubs, stops the stub writer and closes the connection.
+
+        Registered with atexit; calling it earlier (e.g. from tests) is fine and later calls do nothing.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self.flush_stubs()
+        self._stub_queue.put(None)
+        self._stub_writer.join()
+        self._optimize_db()
+        with self._lock:
+            self._conn.close()
+
+    def _optimize_db(self):
+        """Lets SQLite refresh planner statistics that have gone stale. Runs from close()."""
+        try:
+            with self._lock:
+                self._conn.execute("PRAGMA optimize")
+        except sqlite3.Error as e:
+            logger.warning("PRAGMA optimize failed: %s", e)
+
+    @contextmanager
+    def _transaction(self):
+        """Runs the block inside BEGIN IMMEDIATE ... COMMIT on the shared connection.
+
+        Rolls back if the block raises. Nested uses join the outer transaction.
+        """
+        with self._lock:
+            if self._conn.in_transaction:
+                yield self._conn
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
 
     def init_db(self):
         """Initializes the SQLite database and creates tables if they don't exist."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                session_id TEXT PRIMARY KEY,
-                player_name TEXT,
-                current_location_name TEXT,
-                player_x INTEGER,
-                player_y INTEGER,
-                inventory TEXT,
-                health INTEGER,
-                gold INTEGER,
-                quest_log TEXT,
-                npc_states TEXT,
-                conversation_history TEXT,
-                conversation_partner TEXT,
-                game_mode TEXT
-            )
-        ''')
-        # Attempt to add game_mode column if it doesn't exist (migration)
-        try:
-            cursor.execute("ALTER TABLE sessions ADD COLUMN game_mode TEXT DEFAULT 'EXPLORATION'")
-        except sqlite3.OperationalError:
-            pass # Column likely already exists
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            # Schema and migrations below are idempotent but not free; skip them once the file is current
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
 
-        # Attempt to add response columns to quests table (migration)
-        try:
-            cursor.execute("ALTER TABLE quests ADD COLUMN accept_response TEXT")
-            cursor.execute("ALTER TABLE quests ADD COLUMN refuse_response TEXT")
-        except sqlite3.OperationalError:
-            pass # Columns likely already exist
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    player_name TEXT,
+                    current_location_name TEXT,
+                    player_x INTEGER,
+                    player_y INTEGER,
+                    inventory TEXT,
+                    health INTEGER,
+                    gold INTEGER,
+                    quest_log TEXT,
+                    npc_states TEXT,
+                    conversation_history TEXT,
+                    conversation_partner TEXT,
+                    game_mode TEXT
+                )
+            ''')
+            # Attempt to add game_mode column if it doesn't exist (migration)
+            try:
+                cursor.execute("ALTER TABLE sessions ADD COLUMN game_mode TEXT DEFAULT 'EXPLORATION'")
+            except sqlite3.OperationalError:
+                pass # Column likely already exists
+
+            # Attempt to add response columns to quests table (migration)
+            try:
+                cursor.execute("ALTER TABLE quests ADD COLUMN accept_response TEXT")
+                cursor.execute("ALTER TABLE quests ADD COLUMN refuse_response TEXT")
+            except sqlite3.OperationalError:
+                pass # Columns likely already exist
+
+            # New Tables for Challenge System
+            # player_stats is only ever looked up by its primary key, so it is stored WITHOUT ROWID
+            player_stats_ddl = '''
+                CREATE TABLE IF NOT EXISTS {name} (
+                    session_id TEXT PRIMARY KEY,
+                    strength INTEGER DEFAULT 10,
+                    dexterity INTEGER DEFAULT 10,
+                    intelligence INTEGER DEFAULT 10,
+                    charisma INTEGER DEFAULT 10,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                ) WITHOUT ROWID
+            '''
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'player_stats'")
+            row = cursor.fetchone()
+            if row and "WITHOUT ROWID" not in row[0].upper():
+                # Rebuild a pre-existing rowid table (migration)
+                cursor.execute(player_stats_ddl.format(name="player_stats_new"))
+                cursor.execute("INSERT INTO player_stats_new SELECT session_id, strength, dexterity, intelligence, charisma FROM player_stats")
+                cursor.execute("DROP TABLE player_stats")
+                cursor.execute("ALTER TABLE player_stats_new RENAME TO player_stats")
+            cursor.execute(player_stats_ddl.format(name="player_stats"))
 
-        conn.commit()
-        
-        # New Tables for Challenge System
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS player_stats (
-                session_id TEXT PRIMARY KEY,
-                strength INTEGER DEFAULT 10,
-                dexterity INTEGER DEFAULT 10,
-                intelligence INTEGER DEFAULT 10,
-                charisma INTEGER DEFAULT 10,
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS quests (
-                id TEXT PRIMARY KEY,
-                session_id TEXT,
-                giver_npc TEXT,
-                description TEXT,
-                status TEXT DEFAULT 'active',
-                involved_entities TEXT,
-                accept_response TEXT,
-                refuse_response TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS challenges (
-                id TEXT PRIMARY KEY,
-                session_id TEXT,
-                quest_id TEXT,
-                type TEXT,
-                dc INTEGER,
-                description TEXT,
-                completed BOOLEAN DEFAULT FALSE,
-                result TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS entity_stubs (
-                id TEXT PRIMARY KEY,
-                session_id TEXT,
-                name TEXT,
-                type TEXT,
-                description TEXT,
-                related_to TEXT,
-                status TEXT,
-                needs_expansion BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS quests (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT,
+                    giver_npc TEXT,
+                    description TEXT,
+                    status TEXT DEFAULT 'active',
+                    involved_entities TEXT,
+                    accept_response TEXT,
+                    refuse_response TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS challenges (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT,
+                    quest_id TEXT,
+                    type TEXT,
+                    dc INTEGER,
+                    description TEXT,
+                    completed BOOLEAN DEFAULT FALSE,
+                    result TEXT,
+                    success BOOLEAN,
+                    severity TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS entity_stubs (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT,
+                    name TEXT,
+                    type TEXT,
+                    description TEXT,
+                    related_to TEXT,
+                    status TEXT,
+                    needs_expansion BOOLEAN DEFAULT TRUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                )
+            ''')
+
+            # Inventory and quest log entries live in child tables so adding/removing one touches one row
+            for table, value_column, order_column in SESSION_LIST_TABLES.values():
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        session_id TEXT,
+                        {order_column} INTEGER,
+                        {value_column} TEXT,
+                        PRIMARY KEY (session_id, {order_column}),
+                        FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                    )
+                ''')
+                # Removal deletes the first matching entry, so index the value with its order
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_session_{value_column} ON {table}(session_id, {value_column}, {order_column})")
+            # Move lists still stored as JSON on the session row into the child tables (migration)
+            for field, (table, value_column, order_column) in SESSION_LIST_TABLES.items():
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO {table} (session_id, {order_column}, {value_column})
+                    SELECT s.session_id, j.key, j.value
+                    FROM sessions s, json_each(s.{field}) j
+                    WHERE s.{field} IS NOT NULL AND json_valid(s.{field})
+                ''')
+                cursor.execute(f"UPDATE sessions SET {field} = NULL WHERE {field} IS NOT NULL")
+
+            # NPC states get one row each, so changing one NPC does not rewrite every other NPC
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS npc_states (
+                    session_id TEXT,
+                    npc_name TEXT,
+                    state TEXT,
+                    PRIMARY KEY (session_id, npc_name)
+                ) WITHOUT ROWID
+            ''')
+            # Move NPC states still stored as JSON on the session row (migration)
+            cursor.execute('''
+                INSERT OR IGNORE INTO npc_states (session_id, npc_name, state)
+                SELECT s.session_id, j.key, j.value
+                FROM sessions s, json_each(s.npc_states) j
+                WHERE s.npc_states IS NOT NULL AND json_valid(s.npc_states)
+            ''')
+            cursor.execute("UPDATE sessions SET npc_states = NULL WHERE npc_states IS NOT NULL")
+
+            # Dialogue turns are appended one row at a time instead of rewriting the whole history
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_history (
+                    session_id TEXT,
+                    turn_idx INTEGER,
+                    role TEXT,
+                    content TEXT,
+                    PRIMARY KEY (session_id, turn_idx)
+                ) WITHOUT ROWID
+            ''')
+            # Move histories still stored as JSON on the session row (migration)
+            cursor.execute('''
+                INSERT OR IGNORE INTO conversation_history (session_id, turn_idx, role, content)
+                SELECT s.session_id, j.key, json_extract(j.value, '$.role'), json_extract(j.value, '$.parts[0]')
+                FROM sessions s, json_each(s.conversation_history) j
+                WHERE s.conversation_history IS NOT NULL AND json_valid(s.conversation_history)
+            ''')
+            cursor.execute("UPDATE sessions SET conversation_history = NULL WHERE conversation_history IS NOT NULL")
+
+            # Attempt to add typed outcome columns to challenges table (migration)
+            try:
+                cursor.execute("ALTER TABLE challenges ADD COLUMN success BOOLEAN")
+                cursor.execute("ALTER TABLE challenges ADD COLUMN severity TEXT")
+            except sqlite3.OperationalError:
+                pass # Columns likely already exist
+            cursor.execute('''
+                UPDATE challenges
+                SET success = COALESCE(json_extract(result, '$.success'), 0),
+                    severity = json_extract(result, '$.severity')
+                WHERE result IS NOT NULL AND success IS NULL
+            ''')
+
+            # Indexes for the per-quest challenge checks and per-session lookups
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_challenges_quest_completed ON challenges(quest_id, completed)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_entity_stubs_session_id ON entity_stubs(session_id, id)")
+            # Per-session lookups: quest lists filter on status too, stubs on needs_expansion
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_quests_session_status ON quests(session_id, status)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_challenges_session ON challenges(session_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_entity_stubs_session_expansion ON entity_stubs(session_id, needs_expansion)")
+
+            # Seed planner statistics once so those indexes get picked; PRAGMA optimize keeps them fresh (see _optimize_db)
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                cursor.execute("ANALYZE challenges")
+                cursor.execute("ANALYZE entity_stubs")
+
+            # Challenge types are stored lowercased so readers can index player stats directly (migration)
+            cursor.execute("UPDATE challenges SET type = lower(type) WHERE type <> lower(type)")
+
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
     def should_require_roll(self, challenge_dc: int, player_stat: int) -> Dict[str, Any]:
         """
@@ -282,23 +743,13 @@ class GameStateManager:
         """
         margin = player_stat - challenge_dc
         
+        # Callers merge the result into challenge dicts, so hand out copies of the shared outcomes
         if margin >= 5:
-            return {
-                "requires_roll": False,
-                "outcome": "auto_success",
-                "narrative": "Trivial task."
-            }
+            return dict(ROLL_AUTO_SUCCESS)
         elif margin <= -10:
-            return {
-                "requires_roll": False,
-                "outcome": "auto_failure",
-                "narrative": "Beyond your ability."
-            }
+            return dict(ROLL_AUTO_FAILURE)
         else:
-            return {
-                "requires_roll": True,
-                "outcome": "uncertain"
-            }
+            return dict(ROLL_UNCERTAIN)
 
     def calculate_failure_severity(self, roll_total: int, dc: int, is_crit_fail: bool = False) -> str:
         """
@@ -321,23 +772,28 @@ class GameStateManager:
         Updates the relationship score with an NPC.
         change_amount can be an integer or an event string (e.g., 'quest_accepted').
         """
-        npc_state = self.get_npc_state(session_id, npc_name)
-        
         modifier = 0
         if isinstance(change_amount, str):
             modifier = RELATIONSHIP_MODIFIERS.get(change_amount, 0)
         else:
             modifier = change_amount
 
-        current_relationship = npc_state.get("relationship", 50)
-        new_relationship = max(0, min(100, current_relationship + modifier))
-        
-        npc_state["relationship"] = new_relationship
-        
         # TODO: Implement mood changes based on quest outcomes and relationship
-        
-        self.update_npc_state(session_id, npc_name, npc_state)
-        logger.info(f"Updated relationship with {npc_name}: {current_relationship} -> {new_relationship} (Modifier: {modifier})")
+
+        # Joins the caller's transaction if one is open (see resolve_challenge)
+        with self._transaction() as conn:
+            previous = conn.execute(SQL_SELECT_RELATIONSHIP, (session_id, npc_name)).fetchone()
+            row = conn.execute(SQL_ADJUST_RELATIONSHIP, {
+                "session_id": session_id, "npc_name": npc_name,
+                "default_state": json.dumps(DEFAULT_NPC_STATE), "modifier": modifier,
+            }).fetchone()
+        if row is None:
+            return
+        npc_state = json.loads(row[0])
+        self._patch_cached_npc_states(session_id, {npc_name: npc_state})
+        current_relationship = previous[0] if previous and previous[0] is not None else DEFAULT_NPC_STATE["relationship"]
+        logger.info("Updated relationship with %s: %s -> %s (Modifier: %s)",
+                    npc_name, current_relationship, npc_state["relationship"], modifier)
 
     def get_tier_config(self, tier_name: str) -> Dict[str, Any]:
         """Retrieves configuration for a specific entity tier."""
@@ -446,37 +902,168 @@ class GameStateManager:
         return quest_data
 
     def _get_session_data(self, session_id: str) -> Dict[str, Any] | None:
-        """Helper to retrieve full session data."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            data = dict(row)
-            # Deserialize JSON fields
-            for field in ['inventory', 'quest_log', 'npc_states', 'conversation_history']:
-                if data[field]:
-                    try:
-                        data[field] = json.loads(data[field])
-                    except json.JSONDecodeError:
-                        data[field] = [] if field != 'npc_states' else {}
+        """Helper to retrieve full session data (cache first, SQLite on miss)."""
+        if self._session_cache is not None:
+            cached = self._session_cache.get(session_id)
+            if cached is not None:
+                # Callers mutate what they get back before writing it, so hand out a copy, taken
+                # under the lock so it cannot interleave with append_conversation_turns
+                with self._lock:
+                    return {k: _copy_session_value(v) for k, v in cached.items()}
+        else:
+            generation = None
+            try:
+                blob, generation = self._kv.mget(_session_key(session_id), _session_generation_key(session_id))
+            except redis.RedisError as e:
+                logger.warning("Redis read failed, loading session %s from SQLite: %s", session_id, e)
+            else:
+                if blob is not None:
+                    return json.loads(blob)
+
+        with self._lock:
+            data = _fetch_dict(self._conn.execute(SQL_SELECT_SESSION, (session_id,)))
+        
+        if data:
+            with self._lock:
+                for field, sql in SQL_SELECT_SESSION_LIST.items():
+                    cursor = self._conn.execute(sql, (session_id,))
+                    data[field] = [row[0] for row in cursor]
+                data["npc_states"] = json.loads(self._conn.execute(SQL_SELECT_NPC_STATES, (session_id,)).fetchone()[0])
+                cursor = self._conn.execute(SQL_SELECT_CONVERSATION, (session_id,))
+                data["conversation_history"] = [{"role": role, "parts": [content]} for role, content in cursor]
+            if self._session_cache is not None:
+                self._session_cache.set(session_id, {k: _copy_session_value(v) for k, v in data.items()})
+            else:
+                self._store_session_blob(session_id, data, generation)
             return data
         return None
 
+    def _store_session_blob(self, session_id: str, data: Dict[str, Any], generation: str | None):
+        """Caches a session read from SQLite in Redis, unless a write has bumped its generation since.
+
+        Otherwise a writer on another worker could commit and drop the key between our SELECT and
+        this SET, leaving the snapshot from before its write cached for SESSION_CACHE_TTL.
+        """
+        generation_key = _session_generation_key(session_id)
+        try:
+            with self._kv.pipeline() as pipe:
+                pipe.watch(generation_key)
+                if pipe.get(generation_key) != generation:
+                    return
+                pipe.multi()
+                pipe.set(_session_key(session_id), json.dumps(data), ex=SESSION_CACHE_TTL)
+                pipe.execute()
+        except redis.WatchError:
+            pass  # A write landed meanwhile; the next read loads the session again
+        except redis.RedisError as e:
+            logger.warning("Redis write failed, session %s not cached: %s", session_id, e)
+
+    def _drop_session_blob(self, session_id: str):
+        """Deletes the Redis copy of a session and bumps its generation (see _store_session_blob)."""
+        generation_key = _session_generation_key(session_id)
+        try:
+            with self._kv.pipeline() as pipe:
+                pipe.incr(generation_key)
+                pipe.expire(generation_key, SESSION_CACHE_TTL)
+                pipe.delete(_session_key(session_id))
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis write failed, cached session %s may be stale: %s", session_id, e)
+
+    def _get_session_scalar(self, session_id: str, field: str, default: Any) -> Any:
+        """Reads one scalar field: from the decoded cache if present, else a single-column SELECT."""
+        if self._session_cache is not None:
+            cached = self._session_cache.get(session_id)
+            if cached is not None:
+                return cached[field]
+        with self._lock:
+            row = self._conn.execute(SQL_SELECT_SESSION_SCALAR[field], (session_id,)).fetchone()
+        return row[0] if row else default
+
     def _update_session_field(self, session_id: str, field: str, value: Any):
-        """Helper to update a single field in the session."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        if field in ['inventory', 'quest_log', 'npc_states', 'conversation_history']:
-            value = json.dumps(value)
-            
-        cursor.execute(f"UPDATE sessions SET {field} = ? WHERE session_id = ?", (value, session_id))
-        conn.commit()
-        conn.close()
+        """Helper to update a single field in the session (write-through to the cache)."""
+        # Direct lookup of the prebuilt statement; set_health/set_gold and friends come through here
+        sql = SQL_UPDATE_SESSION.get((field,))
+        if sql is None:
+            raise ValueError(f"Unknown session fields: {field}")
+        with self._transaction() as conn:
+            conn.execute(sql, (value, session_id))
+        self._patch_cached_session(session_id, **{field: value})
+
+    def _update_session_fields(self, session_id: str, **fields: Any):
+        """Updates several session fields with one UPDATE (write-through to the cache)."""
+        columns = tuple(fields)
+        sql = SQL_UPDATE_SESSION.get(columns)
+        if sql is None:
+            unknown = [field for field in columns if field not in SESSION_UPDATE_FIELDS]
+            if unknown:
+                raise ValueError(f"Unknown session fields: {', '.join(unknown)}")
+            assignments = ", ".join(f"{field} = ?" for field in columns)
+            sql = SQL_UPDATE_SESSION[columns] = f"UPDATE sessions SET {assignments} WHERE session_id = ?"
+        # Joins the caller's transaction if one is open (see resolve_challenge)
+        with self._transaction() as conn:
+            conn.execute(sql, (*fields.values(), session_id))
+
+        self._patch_cached_session(session_id, **fields)
+
+    def _patch_cached_session(self, session_id: str, **fields: Any):
+        """Applies already-persisted field values to the cached session, if it is cached."""
+        if "inventory" in fields:
+            self._inventory_lower.pop(session_id, None)
+
+        if self._session_cache is not None:
+            cached = self._session_cache.get(session_id)
+            if cached is not None:
+                cached.update({k: _copy_session_value(v) for k, v in fields.items()})
+            return
+        # Another worker may be patching the same blob, so drop it rather than read-modify-write it
+        self._drop_session_blob(session_id)
+
+    def _patch_cached_npc_states(self, session_id: str, states: Dict[str, Dict[str, Any]]):
+        """Replaces already-persisted NPC states in the cached session, if it is cached."""
+        cached = self._session_cache.get(session_id) if self._session_cache is not None else None
+        if cached is not None:
+            npc_states = cached["npc_states"]
+            for npc_name, state in states.items():
+                previous = npc_states.get(npc_name, {})
+                # The NPC grid only needs rebuilding if an NPC moved
+                if any(previous.get(k) != state.get(k) for k in ("location", "x", "y")):
+                    self._npc_grid.pop(session_id, None)
+                npc_states[npc_name] = dict(state)
+            return
+        self._npc_grid.pop(session_id, None)
+        if self._session_cache is None:
+            self._drop_session_blob(session_id)
+
+    def _append_session_list(self, session_id: str, field: str, value: str):
+        """Appends one entry to a list field's child table."""
+        with self._transaction() as conn:
+            conn.execute(SQL_APPEND_SESSION_LIST[field], (session_id, session_id, value))
+
+    def _remove_session_list(self, session_id: str, field: str, value: str):
+        """Removes the first matching entry from a list field's child table."""
+        with self._transaction() as conn:
+            conn.execute(SQL_REMOVE_SESSION_LIST[field], (session_id, value))
+
+    def _invalidate_session(self, session_id: str):
+        """Drops the cached copy of a session so the next read comes from SQLite."""
+        if self._session_cache is not None:
+            self._session_cache.pop(session_id)
+        else:
+            self._drop_session_blob(session_id)
+        self._forget_session(session_id)
+
+    def _forget_session(self, session_id: str):
+        """Drops the per-session indexes derived from a session that left the cache.
+
+        Called by _invalidate_session and whenever the _SessionCache evicts a session, so these
+        dicts stay as bounded as the cache itself.
+        """
+        self._npc_grid.pop(session_id, None)
+        self._loc_name_index.pop(session_id, None)
+        self._inventory_lower.pop(session_id, None)
+        self._synced_sessions.discard(session_id)
+        self._stub_cache.pop(session_id, None)
 
     def create_session(self, session_id: str, player_name: str = "Traveler"):
         """Creates a new game session."""
@@ -494,7 +1081,7 @@ class GameStateManager:
                 }
 
         # Get the first location from the loaded world
-        first_location_name = list(game_world.locations.keys())[0]
+        first_location_name = game_world.first_location_name
         first_location = game_world.get_location(first_location_name)
 
         player_start_x = 0
@@ -503,34 +1090,33 @@ class GameStateManager:
             player_start_x = first_location.player_initial_location.get("x", 0)
             player_start_y = first_location.player_initial_location.get("y", 0)
 
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO sessions (
-                session_id, player_name, current_location_name, player_x, player_y,
-                inventory, health, gold, quest_log, npc_states, conversation_history, conversation_partner, game_mode
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            session_id, player_name, first_location_name, player_start_x, player_start_y,
-            json.dumps([]), 100, 0, json.dumps([]), json.dumps(npc_states), json.dumps([]), None, "EXPLORATION"
-        ))
-        conn.commit()
-
-        # Initialize Player Stats
-        cursor.execute('INSERT INTO player_stats (session_id) VALUES (?)', (session_id,))
-        conn.commit()
-        
-        conn.close()
-        print(f"Session {session_id} created with initial NPC states.")
+        # Both rows are written in one transaction. OR IGNORE plus the rowcount check makes a
+        # concurrent create_session for the same id a no-op instead of an IntegrityError.
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR IGNORE INTO sessions (
+                    session_id, player_name, current_location_name, player_x, player_y,
+                    inventory, health, gold, quest_log, npc_states, conversation_history, conversation_partner, game_mode
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                session_id, player_name, first_location_name, player_start_x, player_start_y,
+                None, 100, 0, None, None, None, None, "EXPLORATION"
+            ))
+            if cursor.rowcount == 0:
+                return
+            cursor.execute(SQL_UPSERT_NPC_STATES, (session_id, json.dumps(npc_states)))
+
+            # Initialize Player Stats
+            cursor.execute('INSERT OR IGNORE INTO player_stats (session_id) VALUES (?)', (session_id,))
+        logger.info("Session %s created with initial NPC states.", session_id)
+        self._active_session = None
+        self.sync_world_npcs(session_id)
 
     def session_exists(self, session_id: str) -> bool:
         """Checks if a session exists."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,))
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
 
     def get_conversation_partner(self, session_id: str) -> Optional[str]:
         """Retrieves the current conversation partner ID."""
@@ -544,14 +1130,27 @@ class GameStateManager:
         data = self._get_session_data(session_id)
         return data.get("conversation_history", []) if data else []
 
-    def update_conversation_history(self, session_id: str, history: List[Dict]):
-        """Updates the conversation history for a given session."""
-        self._update_session_field(session_id, "conversation_history", history)
+    def append_conversation_turn(self, session_id: str, role: str, content: str):
+        """Appends one dialogue turn to the conversation history for a given session."""
+        self.append_conversation_turns(session_id, [(role, content)])
+
+    def append_conversation_turns(self, session_id: str, turns: List[Tuple[str, str]]):
+        """Appends (role, content) turns in order, one row each, without rewriting earlier turns."""
+        # /interact appends on the event loop while update_history_background runs on a worker
+        # thread, so the rows and the cached list are both extended under the connection lock
+        with self._lock:
+            with self._transaction() as conn:
+                conn.executemany(SQL_APPEND_CONVERSATION, [(session_id, session_id, role, content) for role, content in turns])
+            if self._session_cache is None:
+                self._drop_session_blob(session_id)
+                return
+            cached = self._session_cache.get(session_id)
+            if cached is not None:
+                cached["conversation_history"].extend({"role": role, "parts": [content]} for role, content in turns)
 
     def get_player_name(self, session_id: str) -> str:
         """Retrieves the player's name for a given session."""
-        data = self._get_session_data(session_id)
-        return data.get("player_name", "Traveler") if data else "Traveler"
+        return self._get_session_scalar(session_id, "player_name", "Traveler")
 
     def set_player_name(self, session_id: str, name: str):
         """Sets the player's name for a given session."""
@@ -559,8 +1158,7 @@ class GameStateManager:
 
     def get_current_location_name(self, session_id: str) -> str:
         """Retrieves the player's current location name for a given session."""
-        data = self._get_session_data(session_id)
-        return data.get("current_location_name", "Unknown Location") if data else "Unknown Location"
+        return self._get_session_scalar(session_id, "current_location_name", "Unknown Location")
 
     def get_world_name(self) -> str:
         """Retrieves the current world name."""
@@ -568,13 +1166,15 @@ class GameStateManager:
 
     def set_current_location_name(self, session_id: str, location_name: str):
         """Sets the player's current location name for a given session."""
-        self._update_session_field(session_id, "current_location_name", location_name)
+        fields = {"current_location_name": location_name}
         
         # Update player's x and y to the initial location of the new room
         new_location = game_world.get_location(location_name)
         if new_location and new_location.player_initial_location:
-            self._update_session_field(session_id, "player_x", new_location.player_initial_location["x"])
-            self._update_session_field(session_id, "player_y", new_location.player_initial_location["y"])
+            fields["player_x"] = new_location.player_initial_location["x"]
+            fields["player_y"] = new_location.player_initial_location["y"]
+        self._update_session_fields(session_id, **fields)
+        self.sync_world_npcs(session_id)
 
     def get_current_location_description(self, session_id: str) -> Dict[str, str]:
         """Retrieves the description components of the player's current location."""
@@ -597,28 +1197,24 @@ class GameStateManager:
         # Add feature description if player is on a feature
         player_x = session["player_x"]
         player_y = session["player_y"]
-        current_cell_char = location.raw_layout[player_y][player_x]
-        for feature in location.features:
-            if feature.name == location.map_key.get(current_cell_char):
-                description_parts["current_feature_description"] = f"Located here is {feature.description}"
-                break
+        features_by_char = game_world.features_by_char(location)
+        layout = location.raw_layout
+        rows, cols = len(layout), len(layout[0])
+        current_cell_char = layout[player_y][player_x]
+        feature = features_by_char.get(current_cell_char)
+        if feature:
+            description_parts["current_feature_description"] = f"Located here is {feature.description}"
 
         # Add descriptions of notable features in adjacent squares
         adjacent_features_list = []
         structured_adjacent_features = []
-        directions = {
-            "North": (0, -1), "South": (0, 1), "East": (1, 0), "West": (-1, 0),
-            "North-East": (1, -1), "North-West": (-1, -1), "South-East": (1, 1), "South-West": (-1, 1)
-        }
-        for direction, (dx, dy) in directions.items():
+        for direction, (dx, dy) in ADJACENT_DIRECTIONS.items():
             adj_x, adj_y = player_x + dx, player_y + dy
-            if 0 <= adj_y < len(location.raw_layout) and 0 <= adj_x < len(location.raw_layout[0]):
-                adj_cell_char = location.raw_layout[adj_y][adj_x]
-                for feature in location.features:
-                    if feature.name == location.map_key.get(adj_cell_char):
-                        adjacent_features_list.append(f"To the {direction} there is {feature.name}.")
-                        structured_adjacent_features.append({"name": feature.name, "direction": direction})
-                        break
+            if 0 <= adj_y < rows and 0 <= adj_x < cols:
+                feature = features_by_char.get(layout[adj_y][adj_x])
+                if feature:
+                    adjacent_features_list.append(f"To the {direction} there is {feature.name}.")
+                    structured_adjacent_features.append({"name": feature.name, "direction": direction})
         if adjacent_features_list:
             description_parts["adjacent_features_description"] = " ".join(adjacent_features_list)
         
@@ -642,23 +1238,36 @@ class GameStateManager:
         data = self._get_session_data(session_id)
         return data.get("inventory", []) if data else []
 
+    def _get_inventory_lower(self, session_id: str) -> Dict[str, str]:
+        """Maps lowered item names to their inventory spelling, first occurrence wins."""
+        lowered = self._inventory_lower.get(session_id)
+        if lowered is None:
+            lowered = {}
+            for item in self.get_inventory(session_id):
+                lowered.setdefault(item.lower(), item)
+            # Only kept without Redis; with it another worker may change the inventory unseen
+            if self._session_cache is not None:
+                self._inventory_lower[session_id] = lowered
+        return lowered
+
     def add_item_to_inventory(self, session_id: str, item: str):
         """Adds an item to the player's inventory for a given session."""
         inventory = self.get_inventory(session_id)
         inventory.append(item)
-        self._update_session_field(session_id, "inventory", inventory)
+        self._append_session_list(session_id, "inventory", item)
+        self._patch_cached_session(session_id, inventory=inventory)
 
     def remove_item_from_inventory(self, session_id: str, item: str):
         """Removes an item from the player's inventory for a given session."""
         inventory = self.get_inventory(session_id)
         if item in inventory:
             inventory.remove(item)
-            self._update_session_field(session_id, "inventory", inventory)
+            self._remove_session_list(session_id, "inventory", item)
+            self._patch_cached_session(session_id, inventory=inventory)
 
     def get_health(self, session_id: str) -> int:
         """Retrieves the player's health for a given session."""
-        data = self._get_session_data(session_id)
-        return data.get("health", 100) if data else 100
+        return self._get_session_scalar(session_id, "health", 100)
 
     def set_health(self, session_id: str, health: int):
         """Sets the player's health for a given session."""
@@ -666,8 +1275,7 @@ class GameStateManager:
 
     def get_gold(self, session_id: str) -> int:
         """Retrieves the player's gold for a given session."""
-        data = self._get_session_data(session_id)
-        return data.get("gold", 0) if data else 0
+        return self._get_session_scalar(session_id, "gold", 0)
 
     def set_gold(self, session_id: str, gold: int):
         """Sets the player's gold for a given session."""
@@ -687,55 +1295,40 @@ class GameStateManager:
         player_x = session["player_x"]
         player_y = session["player_y"]
 
-        new_x, new_y = player_x, player_y
-
-        if direction == "north":
-            new_y -= 1
-        elif direction == "south":
-            new_y += 1
-        elif direction == "east":
-            new_x += 1
-        elif direction == "west":
-            new_x -= 1
-        else:
+        offset = MOVE_DIRECTIONS.get(direction)
+        if offset is None:
             return "Invalid direction."
+        new_x, new_y = player_x + offset[0], player_y + offset[1]
 
         # Check boundaries
-        if not (0 <= new_y < len(location.raw_layout) and 
-                0 <= new_x < len(location.raw_layout[0])):
+        layout = location.raw_layout
+        rows, cols = len(layout), len(layout[0])
+        if not (0 <= new_y < rows and 0 <= new_x < cols):
             return "You cannot move in that direction. You would fall off the map!"
 
         # Check for collisions with impassable elements (walls)
-        target_cell = location.raw_layout[new_y][new_x]
+        target_cell = layout[new_y][new_x]
         if target_cell in location.map_key and location.map_key[target_cell] == "Wall":
             return "You hit a wall!"
 
-        self._update_session_field(session_id, "player_x", new_x)
-        self._update_session_field(session_id, "player_y", new_y)
-        
-        # Refresh session data after update
-        session = self._get_session_data(session_id)
+        self._update_session_fields(session_id, player_x=new_x, player_y=new_y)
 
         response_message = f"You move {direction}."
 
         # Get current feature description
-        current_cell_char = location.raw_layout[new_y][new_x]
-        for feature in location.features:
-            if feature.name == location.map_key.get(current_cell_char):
-                response_message += f"\nYou are standing on: {feature.description}"
-                break
+        features_by_char = game_world.features_by_char(location)
+        feature = features_by_char.get(target_cell)
+        if feature:
+            response_message += f"\nYou are standing on: {feature.description}"
 
         # Get adjacent feature names
         adjacent_features_list = []
-        directions = {"north": (0, -1), "south": (0, 1), "east": (1, 0), "west": (-1, 0)}
-        for dir_name, (dx, dy) in directions.items():
+        for dir_name, (dx, dy) in MOVE_DIRECTIONS.items():
             adj_x, adj_y = new_x + dx, new_y + dy
-            if 0 <= adj_y < len(location.raw_layout) and 0 <= adj_x < len(location.raw_layout[0]):
-                adj_cell_char = location.raw_layout[adj_y][adj_x]
-                for feature in location.features:
-                    if feature.name == location.map_key.get(adj_cell_char):
-                        adjacent_features_list.append(f"To the {dir_name} is {feature.name}.")
-                        break
+            if 0 <= adj_y < rows and 0 <= adj_x < cols:
+                feature = features_by_char.get(layout[adj_y][adj_x])
+                if feature:
+                    adjacent_features_list.append(f"To the {dir_name} is {feature.name}.")
         if adjacent_features_list:
             response_message += "\n" + " ".join(adjacent_features_list)
 
@@ -744,8 +1337,7 @@ class GameStateManager:
         if npcs_in_location:
             npc_descriptions = []
             for npc in npcs_in_location:
-                npc_state = session["npc_states"][npc["id"]]
-                if npc_state["x"] == new_x and npc_state["y"] == new_y:
+                if npc["x"] == new_x and npc["y"] == new_y:
                     npc_descriptions.append(f"{npc['name']}: {npc['short_description']}")
             if npc_descriptions:
                 response_message += f"\nYou see:\n- {', '.join(npc_descriptions)}"
@@ -783,19 +1375,32 @@ class GameStateManager:
 
     def add_quest_to_log(self, session_id: str, quest: str):
         """Adds a quest to the player's quest log for a given session."""
-        quest_log = self.get_quest_log(session_id)
+        data = self._get_session_data(session_id)
+        quest_log = data.get("quest_log", []) if data else []
         quest_log.append(quest)
-        self._update_session_field(session_id, "quest_log", quest_log)
+        self._append_session_list(session_id, "quest_log", quest)
+        self._patch_cached_session(session_id, quest_log=quest_log)
 
     def remove_quest_from_log(self, session_id: str, quest: str):
         """Removes a quest from the player's quest log for a given session."""
-        quest_log = self.get_quest_log(session_id)
+        data = self._get_session_data(session_id)
+        quest_log = data.get("quest_log", []) if data else []
         if quest in quest_log:
             quest_log.remove(quest)
-            self._update_session_field(session_id, "quest_log", quest_log)
+            self._remove_session_list(session_id, "quest_log", quest)
+            self._patch_cached_session(session_id, quest_log=quest_log)
 
     async def process_command(self, session_id: str, command: str) -> str:
         """Processes a game command and returns a response."""
+        # The state helpers read, mutate and write back whole fields, so two commands for the
+        # same session must not interleave across an await.
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = self._session_locks[session_id] = asyncio.Lock()
+        async with lock:
+            return await self._process_command(session_id, command)
+
+    async def _process_command(self, session_id: str, command: str) -> str:
         command = command.lower().strip()
         session = self._get_session_data(session_id)
         if not session:
@@ -806,7 +1411,7 @@ class GameStateManager:
         
         if game_mode == "INTERACTION":
             if command in ["leave", "exit", "bye", "quit"]:
-                print(f"DEBUG: Processing leave command. Current partner: {self.get_conversation_partner(session_id)}")
+                logger.debug("Processing leave command. Current partner: %s", self.get_conversation_partner(session_id))
                 self.end_interaction(session_id)
                 return "You end the conversation."
             else:
@@ -819,55 +1424,72 @@ class GameStateManager:
                 return "You are in a conversation. Type 'leave' to exit."
 
         # EXPLORATION MODE
-        if command == "inventory":
-            inventory = self.get_inventory(session_id)
-            if inventory:
-                return f"Your inventory: {', '.join(inventory)}."
-            else:
-                return "Your inventory is empty."
-        elif command == "look":
-            description_parts = self.get_current_location_description(session_id)
-            response_message = description_parts["location_description"]
-            if description_parts.get("current_feature_description"):
-                response_message += f"\n{description_parts['current_feature_description']}"
-            if description_parts.get("adjacent_features_description"):
-                response_message += f"\n{description_parts['adjacent_features_description']}"
-            if description_parts.get("npcs_description"):
-                response_message += f"\n{description_parts['npcs_description']}"
-            return response_message
-        elif command.startswith("go "):
-            direction = command[3:].strip()
-            return self.move_player(session_id, direction)
-        elif command.startswith("talk to "):
-            npc_name = command[8:].strip()
-            return self.initiate_dialogue(session_id, npc_name)
-        elif command == "enter":
-            return self.enter_exit(session_id)
-        elif command.startswith("examine ") or command.startswith("look "):
-            target_name = command.split(" ", 1)[1].strip()
-            # Check inventory first
-            inventory = self.get_inventory(session_id)
-            found_item = next((i for i in inventory if target_name.lower() in i.lower()), None)
-            if found_item:
-                return await generate_item_details(found_item)
-            
-            # Check NPCs in location
-            npcs = self.get_npcs_in_location(session_id)
-            found_npc = next((n for n in npcs if target_name.lower() in n["name"].lower()), None)
-            if found_npc:
-                return f"{found_npc['name']}: {found_npc['short_description']}"
-            
-            return f"You don't see '{target_name}' here."
-        elif command == "rumors":
-            location_desc = self.get_current_location_description(session_id)
-            context = f"Location: {location_desc['location_description']}. {location_desc['npcs_description']}"
-            return await generate_quest(context)
+        handler = self._command_handlers.get(command)
+        if handler is not None:
+            return await handler(session_id, "")
+        for prefix, handler in self._prefix_handlers:
+            if command.startswith(prefix):
+                return await handler(session_id, command[len(prefix):].strip())
+        return "I don't understand that command."
+
+    async def _cmd_inventory(self, session_id: str, _: str) -> str:
+        inventory = self.get_inventory(session_id)
+        if inventory:
+            return f"Your inventory: {', '.join(inventory)}."
         else:
-            return "I don't understand that command."
+            return "Your inventory is empty."
+
+    async def _cmd_look(self, session_id: str, _: str) -> str:
+        description_parts = self.get_current_location_description(session_id)
+        response_message = description_parts["location_description"]
+        if description_parts.get("current_feature_description"):
+            response_message += f"\n{description_parts['current_feature_description']}"
+        if description_parts.get("adjacent_features_description"):
+            response_message += f"\n{description_parts['adjacent_features_description']}"
+        if description_parts.get("npcs_description"):
+            response_message += f"\n{description_parts['npcs_description']}"
+        return response_message
+
+    async def _cmd_go(self, session_id: str, direction: str) -> str:
+        return self.move_player(session_id, direction)
+
+    async def _cmd_talk(self, session_id: str, npc_name: str) -> str:
+        return self.initiate_dialogue(session_id, npc_name)
+
+    async def _cmd_enter(self, session_id: str, _: str) -> str:
+        return self.enter_exit(session_id)
+
+    async def _cmd_examine(self, session_id: str, target_name: str) -> str:
+        target_lower = target_name.lower()
+        # Check inventory first
+        # First item in inventory order whose name contains the target, as before the names were pre-lowered
+        inventory_lower = self._get_inventory_lower(session_id)
+        found_item = next((item for lowered, item in inventory_lower.items() if target_lower in lowered), None)
+        if found_item:
+            return await generate_item_details(found_item)
+
+        # Check NPCs in location
+        npcs = self.get_npcs_in_location(session_id)
+        found_npc = next((n for n in npcs if target_lower in n["name_lower"]), None)
+        if found_npc:
+            return f"{found_npc['name']}: {found_npc['short_description']}"
+
+        return f"You don't see '{target_name}' here."
+
+    async def _cmd_rumors(self, session_id: str, _: str) -> str:
+        location_desc = self.get_current_location_description(session_id)
+        context = f"Location: {location_desc['location_description']}. {location_desc['npcs_description']}"
+        return await generate_quest(context)
 
     def get_npc_info(self, npc_id: str) -> Dict[str, Any]:
         character = game_world.get_character(npc_id)
-        return character.dict() if character else None
+        if character is None:
+            return None
+        # Keyed on the model instance too, so a world reload (new Character objects) refreshes the entry
+        cached = self._npc_info_cache.get(npc_id)
+        if cached is None or cached[0] is not character:
+            cached = self._npc_info_cache[npc_id] = (character, character.model_dump())
+        return dict(cached[1])
 
     def get_npc_state(self, session_id: str, npc_name: str) -> Dict[str, Any]:
         """Retrieves the state of a specific NPC, initializing defaults if needed."""
@@ -890,7 +1512,7 @@ class GameStateManager:
         # Let's update if decay happened.
         if full_state["quests_given_recently"] != state.get("quests_given_recently", 0):
              npc_states[npc_name] = full_state
-             self._update_session_field(session_id, "npc_states", npc_states)
+             self._write_npc_states(session_id, npc_states, [npc_name])
              
         return full_state
 
@@ -924,13 +1546,24 @@ class GameStateManager:
             npc_states[npc_name] = {}
             
         npc_states[npc_name].update(updates)
-        self._update_session_field(session_id, "npc_states", npc_states)
+        self._write_npc_states(session_id, npc_states, [npc_name])
+        if "location" in updates:
+            self._index_npc_names(session_id, {npc_name: npc_states[npc_name]})
+
+    def _write_npc_states(self, session_id: str, npc_states: Dict[str, Dict[str, Any]], changed: List[str]):
+        """Upserts the rows of the changed NPCs in one statement, leaving the other NPCs untouched."""
+        states = {npc_name: npc_states[npc_name] for npc_name in changed}
+        with self._transaction() as conn:
+            conn.execute(SQL_UPSERT_NPC_STATES, (session_id, json.dumps(states)))
+        self._patch_cached_npc_states(session_id, states)
 
     def archive_conversation(self, session_id: str):
         """Archives the current conversation history and clears it."""
         # For now, we just clear it, assuming memory has been extracted.
         # In a full implementation, we might append it to a 'long_term_history' field.
-        self._update_session_field(session_id, "conversation_history", [])
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM conversation_history WHERE session_id = ?", (session_id,))
+        self._patch_cached_session(session_id, conversation_history=[])
 
     def sync_world_npcs(self, session_id: str):
         """Syncs NPCs from game_world to the session if they are missing."""
@@ -947,8 +1580,9 @@ class GameStateManager:
             return
 
         logger.info(f"sync_world_npcs: Checking location '{current_location_name}'. NPCs in world: {[c.name for c in location.characters]}")
+        self._synced_sessions.add(session_id)
 
-        updates_needed = False
+        changed = []
         for char in location.characters:
             if char.name not in npc_states:
                 # Add missing NPC to session state
@@ -959,22 +1593,47 @@ class GameStateManager:
                     "relationship": 50,
                     "mood": "content"
                 }
-                updates_needed = True
+                changed.append(char.name)
                 logger.info(f"Synced missing NPC {char.name} to session {session_id}")
             elif char.name == "The Architect":
                 # Force update debug NPC position
                 if npc_states[char.name]["x"] != char.x or npc_states[char.name]["y"] != char.y:
                     npc_states[char.name]["x"] = char.x
                     npc_states[char.name]["y"] = char.y
-                    updates_needed = True
+                    changed.append(char.name)
                     logger.info(f"Force updated The Architect position to {char.x},{char.y}")
         
-        if updates_needed:
-            self._update_session_field(session_id, "npc_states", npc_states)
+        if changed:
+            self._write_npc_states(session_id, npc_states, changed)
+        self._index_npc_names(session_id, npc_states)
+
+    def _index_npc_names(self, session_id: str, npc_states: Dict[str, Dict[str, Any]]) -> Dict[Tuple[str, str], str]:
+        """Adds NPCs to the session's (location, lowered name) lookup used by initiate_dialogue."""
+        index = self._loc_name_index.setdefault(session_id, {})
+        for npc_id, npc_state in npc_states.items():
+            location_name = npc_state.get("location")
+            if location_name:
+                index[(location_name, npc_id.lower())] = npc_id
+        return index
+
+    def _check_world_generation(self):
+        """Drops the NPC syncs and indexes built for a previous world after initialize_game_world runs.
+
+        /start and /load_world reload the world without moving every live session, so those
+        sessions have to sync again to pick up NPCs the new world adds.
+        """
+        if self._world_generation != game_world.generation:
+            self._world_generation = game_world.generation
+            self._synced_sessions.clear()
+            self._loc_name_index.clear()
+            self._npc_grid.clear()
 
     def get_npcs_in_location(self, session_id: str) -> List[Dict]:
-        # Sync NPCs first
-        self.sync_world_npcs(session_id)
+        # NPCs are synced on session creation and location changes; sessions from before a
+        # restart or a world reload get one sync here on first use
+        self._check_world_generation()
+        if session_id not in self._synced_sessions:
+            self.sync_world_npcs(session_id)
         
         session = self._get_session_data(session_id)
         if not session:
@@ -987,24 +1646,47 @@ class GameStateManager:
         npcs_here = []
         logger.info(f"Checking for NPCs in location: {current_location_name}")
 
-        for npc_id, npc_state in session["npc_states"].items():
-            if npc_state["location"] == current_location_name:
-                npc_info = self.get_npc_info(npc_id)
-                if npc_info:
-                    dist = abs(npc_state['x'] - player_x) + abs(npc_state['y'] - player_y)
-                    # Only include NPCs that are in the same tile or adjacent (distance <= 1)
-                    if dist <= 1:
-                        npcs_here.append({
-                            "id": npc_id, 
-                            "name": npc_info["name"], 
-                            "short_description": npc_info["short_description"],
-                            "x": npc_state['x'],
-                            "y": npc_state['y'],
-                            "distance": dist
-                        })
+        # Only NPCs in the same tile or adjacent (distance <= 1) are included, so probe those five cells
+        grid = self._get_npc_grid(session_id, session["npc_states"]).get(current_location_name, {})
+        nearby = sorted(
+            entry
+            for dx, dy in ((0, 0), (1, 0), (-1, 0), (0, 1), (0, -1))
+            for entry in grid.get((player_x + dx, player_y + dy), ())
+        )
+        for _, npc_id in nearby:
+            npc_state = session["npc_states"][npc_id]
+            # Read the model directly; get_npc_info would copy every field via model_dump()
+            character = game_world.get_character(npc_id)
+            if character:
+                dist = abs(npc_state['x'] - player_x) + abs(npc_state['y'] - player_y)
+                npcs_here.append({
+                    "id": npc_id, 
+                    "name": character.name, 
+                    "name_lower": character.name.lower(),
+                    "short_description": character.short_description,
+                    "x": npc_state['x'],
+                    "y": npc_state['y'],
+                    "distance": dist
+                })
         
         return npcs_here
 
+    def _get_npc_grid(self, session_id: str, npc_states: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[Tuple[int, int], List[Tuple[int, str]]]]:
+        """Buckets a session's NPCs by location and tile. Entries keep their npc_states order."""
+        grid = self._npc_grid.get(session_id)
+        if grid is None:
+            grid = {}
+            for position, (npc_id, npc_state) in enumerate(npc_states.items()):
+                location_name = npc_state.get("location")
+                if location_name is None:
+                    continue
+                tiles = grid.setdefault(location_name, {})
+                tiles.setdefault((npc_state["x"], npc_state["y"]), []).append((position, npc_id))
+            # Under Redis other workers move NPCs without dropping this process's grid, so rebuild per call
+            if self._session_cache is not None:
+                self._npc_grid[session_id] = grid
+        return grid
+
     def get_map_display(self, session_id: str) -> Dict[str, Any]:
         """Generates a structured display of the map for the current location."""
         session = self._get_session_data(session_id)
@@ -1017,33 +1699,16 @@ class GameStateManager:
         if not location or not location.raw_layout:
             return {}
 
-        player_x = session["player_x"]
-        player_y = session["player_y"]
-
-        map_grid = []
-        for r_idx, row in enumerate(location.raw_layout):
-            display_row = []
-            for c_idx, cell in enumerate(row):
-                has_npc = False
-                for npc_id, npc_state in session["npc_states"].items():
-                    if (npc_state["location"] == location_name and
-                        npc_state["x"] == c_idx and
-                        npc_state["y"] == r_idx):
-                        has_npc = True
-                        break
-                
-                tile_data = {
-                    "char": cell,
-                    "has_player": r_idx == player_y and c_idx == player_x,
-                    "has_npc": has_npc
-                }
-                display_row.append(tile_data)
-            map_grid.append(display_row)
-        
+        # Rows are sent as-is with player/NPC positions alongside; the client expands them into tiles
+        # The NPC grid is keyed by occupied tile already, so reuse it rather than scanning every NPC
+        self._check_world_generation()
+        npc_positions = sorted(self._get_npc_grid(session_id, session["npc_states"]).get(location_name, {}))
         map_key = location.map_key if location.map_key else {}
 
         return {
-            "grid": map_grid,
+            "chars": location.raw_layout,
+            "player": [session["player_x"], session["player_y"]],
+            "npcs": [list(pos) for pos in npc_positions],
             "key": map_key
         }
 
@@ -1053,36 +1718,42 @@ class GameStateManager:
             return "Session not found."
 
         current_location_name = session.get("current_location_name")
-
-        for npc_id, npc_state in session["npc_states"].items():
-            if npc_state["location"] == current_location_name:
-                npc_info = self.get_npc_info(npc_id)
-                if npc_info and npc_info["name"].lower() == npc_name.lower():
-                    logger.info(f"Initiating dialogue with {npc_id} in session {session_id}")
-                    self._update_session_field(session_id, "conversation_partner", npc_id)
-                    self.set_game_mode(session_id, "INTERACTION")
-                    return f"You begin a conversation with {npc_info['name']}."
+        npc_states = session["npc_states"]
+
+        self._check_world_generation()
+        # Under Redis other workers move NPCs too, so index the states just fetched every time
+        index = self._loc_name_index.get(session_id)
+        if self._session_cache is None or index is None:
+            index = self._index_npc_names(session_id, npc_states)
+
+        npc_id = index.get((current_location_name, npc_name.lower()))
+        # The index only grows, so make sure the NPC has not since moved elsewhere
+        if npc_id and npc_states.get(npc_id, {}).get("location") == current_location_name:
+            character = game_world.get_character(npc_id)
+            if character:
+                logger.info(f"Initiating dialogue with {npc_id} in session {session_id}")
+                self._update_session_fields(session_id, conversation_partner=npc_id, game_mode="INTERACTION")
+                return f"You begin a conversation with {character.name}."
         
         return f"There is no one named {npc_name} here."
 
     def end_interaction(self, session_id: str):
         """Ends the current interaction and switches back to EXPLORATION mode."""
         logger.info(f"Ending interaction in session {session_id}")
-        self._update_session_field(session_id, "conversation_partner", None)
-        self.set_game_mode(session_id, "EXPLORATION")
+        self._update_session_fields(session_id, conversation_partner=None, game_mode="EXPLORATION")
+        # Conversation boundaries are a cheap point to resync the cached session with SQLite
+        self._invalidate_session(session_id)
 
     def get_game_mode(self, session_id: str) -> str:
         """Retrieves the current game mode."""
-        data = self._get_session_data(session_id)
-        return data.get("game_mode", "EXPLORATION") if data else "EXPLORATION"
+        return self._get_session_scalar(session_id, "game_mode", "EXPLORATION")
 
     def set_game_mode(self, session_id: str, mode: str):
         """Sets the current game mode."""
         self._update_session_field(session_id, "game_mode", mode)
 
     def get_conversation_partner(self, session_id: str) -> str | None:
-        data = self._get_session_data(session_id)
-        return data.get("conversation_partner") if data else None
+        return self._get_session_scalar(session_id, "conversation_partner", None)
 
     def process_metadata(self, session_id: str, metadata: Dict[str, Any]):
         """Processes metadata from Gemini response to update game state."""
@@ -1121,236 +1792,242 @@ class GameStateManager:
 
     def get_active_session_id(self) -> str | None:
         """Retrieves an active session ID (for single-player/debug context)."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT session_id FROM sessions LIMIT 1")
-        row = cursor.fetchone()
-        conn.close()
-        return row[0] if row else None
+        cached = self._active_session
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        with self._lock:
+            row = self._conn.execute("SELECT session_id FROM sessions LIMIT 1").fetchone()
+        if row is None:
+            return None
+        self._active_session = (time.monotonic() + ACTIVE_SESSION_TTL, row[0])
+        return row[0]
 
     # --- Challenge System Methods ---
 
     def get_player_stats(self, session_id: str) -> Dict[str, int]:
         """Retrieves player stats."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT strength, dexterity, intelligence, charisma FROM player_stats WHERE session_id = ?", (session_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self._lock:
+            row = _fetch_dict(self._conn.execute(SQL_SELECT_PLAYER_STATS, (session_id,)))
         if row:
-            return dict(row)
-        return {"strength": 10, "dexterity": 10, "intelligence": 10, "charisma": 10}
+            return row
+        return DEFAULT_PLAYER_STATS.copy()
 
     def add_quest(self, session_id: str, quest_data: Dict[str, Any]):
         """Adds a quest and its challenges to the database."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Insert Quest
-        # Insert Quest (OR REPLACE to handle re-offers)
-        cursor.execute('''
-            INSERT OR REPLACE INTO quests (id, session_id, giver_npc, description, status, involved_entities, accept_response, refuse_response)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            quest_data['id'], 
-            session_id, 
-            quest_data['giver_npc'], 
-            quest_data['description'], 
-            quest_data.get('status', 'offered'), # Use provided status or default to offered
-            json.dumps(quest_data.get('involved_entities', [])),
-            quest_data.get('accept_response', "I'm glad you accepted."),
-            quest_data.get('refuse_response', "That is unfortunate.")
-        ))
-
-        # Insert Challenges
-        if 'challenges' in quest_data:
-            for challenge in quest_data['challenges']:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO challenges (id, session_id, quest_id, type, dc, description, completed)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    challenge['id'], # Assuming ID is provided or generated
-                    session_id,
-                    quest_data['id'],
-                    challenge['type'],
-                    challenge['dc'],
-                    challenge['description'],
-                    False
-                ))
-        
-        conn.commit()
-        conn.close()
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Insert Quest
+            # Insert Quest (OR REPLACE to handle re-offers)
+            cursor.execute('''
+                INSERT OR REPLACE INTO quests (id, session_id, giver_npc, description, status, involved_entities, accept_response, refuse_response)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                quest_data['id'], 
+                session_id, 
+                quest_data['giver_npc'], 
+                quest_data['description'], 
+                quest_data.get('status', 'offered'), # Use provided status or default to offered
+                orjson.dumps(quest_data.get('involved_entities', [])).decode(),
+                quest_data.get('accept_response', "I'm glad you accepted."),
+                quest_data.get('refuse_response', "That is unfortunate.")
+            ))
+
+            # Insert Challenges, all rows in one executemany
+            if 'challenges' in quest_data:
+                cursor.executemany(SQL_INSERT_CHALLENGE, [
+                    (
+                        challenge['id'], # Assuming ID is provided or generated
+                        session_id,
+                        quest_data['id'],
+                        challenge['type'].lower(),
+                        challenge['dc'],
+                        challenge['description'],
+                        False
+                    )
+                    for challenge in quest_data['challenges']
+                ])
+
+        # Process involved entities
+        if 'involved_entities' in quest_data:
+            self.process_involved_entities(session_id, quest_data['involved_entities'])
 
     def get_quest_log(self, session_id: str) -> List[str]:
         """Retrieves the player's quest log (titles/descriptions of active/completed quests)."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
         # Fetch active and completed quests
-        cursor.execute("SELECT description FROM quests WHERE session_id = ? AND status IN ('active', 'completed')", (session_id,))
-        rows = cursor.fetchall()
-        conn.close()
-        return [row[0] for row in rows]
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT description FROM quests WHERE session_id = ? AND status IN ('active', 'completed') ORDER BY rowid", (session_id,)
+            )
+            return [row[0] for row in cursor]
 
     def accept_quest(self, session_id: str, quest_id: str) -> str:
         """Updates quest status to 'active' and returns accept response."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get response text
-        cursor.execute("SELECT accept_response FROM quests WHERE id = ? AND session_id = ?", (quest_id, session_id))
-        row = cursor.fetchone()
-        response_text = row['accept_response'] if row and row['accept_response'] else "Quest accepted."
-        
-        cursor.execute("UPDATE quests SET status = 'active' WHERE id = ? AND session_id = ?", (quest_id, session_id))
-        conn.commit()
-        conn.close()
-        
-        # Update Relationship
-        giver = self.get_quest_giver(session_id, quest_id)
-        if giver:
-            self.update_relationship(session_id, giver, "quest_accepted")
-            
-        return response_text
+        return self._decide_quest(session_id, quest_id, SQL_ACCEPT_QUEST, "Quest accepted.", "quest_accepted")
 
     def refuse_quest(self, session_id: str, quest_id: str) -> str:
         """Updates quest status to 'refused' and returns refuse response."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get response text
-        cursor.execute("SELECT refuse_response FROM quests WHERE id = ? AND session_id = ?", (quest_id, session_id))
-        row = cursor.fetchone()
-        response_text = row['refuse_response'] if row and row['refuse_response'] else "Quest refused."
-        
-        cursor.execute("UPDATE quests SET status = 'refused' WHERE id = ? AND session_id = ?", (quest_id, session_id))
-        conn.commit()
-        conn.close()
-        
-        # Update Relationship
-        giver = self.get_quest_giver(session_id, quest_id)
-        if giver:
-            self.update_relationship(session_id, giver, "quest_refused")
-            
+        return self._decide_quest(session_id, quest_id, SQL_REFUSE_QUEST, "Quest refused.", "quest_refused")
+
+    def _decide_quest(self, session_id: str, quest_id: str, sql: str, default_text: str, event: str) -> str:
+        """Sets the quest status and applies the giver's relationship change in one transaction."""
+        try:
+            with self._transaction() as conn:
+                # RETURNING hands back the response text and giver, so neither needs its own SELECT
+                row = conn.execute(sql, (quest_id, session_id)).fetchone()
+                response_text = row[0] if row and row[0] else default_text
+
+                # Update Relationship
+                giver = row[1] if row else None
+                if giver:
+                    self.update_relationship(session_id, giver, event)
+        except Exception:
+            # The relationship write may already be in the session cache
+            self._invalidate_session(session_id)
+            raise
+
         return response_text
-        
-        # Process involved entities
-        if 'involved_entities' in quest_data:
-            self.process_involved_entities(session_id, quest_data['involved_entities'])
 
     def get_quest_giver(self, session_id: str, quest_id: str) -> Optional[str]:
         """Retrieves the name of the NPC who gave the quest."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT giver_npc FROM quests WHERE id = ? AND session_id = ?", (quest_id, session_id))
-        row = cursor.fetchone()
-        conn.close()
+        with self._lock:
+            row = self._conn.execute("SELECT giver_npc FROM quests WHERE id = ? AND session_id = ?", (quest_id, session_id)).fetchone()
         return row[0] if row else None
 
     def get_active_quests(self, session_id: str) -> List[Dict[str, Any]]:
         """Retrieves active quests and their challenges."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM quests WHERE session_id = ? AND status IN ('active', 'completed', 'failed')", (session_id,))
-        quests = [dict(row) for row in cursor.fetchall()]
+        quests = self._fetch_open_quests(session_id)
         logger.info(f"get_active_quests for {session_id}: Found {len(quests)} quests. IDs: {[q['id'] for q in quests]}")
-        
+
         # Get player stats for auto-resolution check
         stats = self.get_player_stats(session_id)
-        
+
         for quest in quests:
-            cursor.execute("SELECT * FROM challenges WHERE quest_id = ?", (quest['id'],))
-            quest['challenges'] = [dict(row) for row in cursor.fetchall()]
-            quest['involved_entities'] = json.loads(quest['involved_entities']) if quest['involved_entities'] else []
-            
             # Calculate auto-result for active challenges
             if quest['status'] == 'active':
                 for challenge in quest['challenges']:
                     if not challenge['completed']:
-                        stat_value = stats.get(challenge['type'].lower(), 10)
+                        stat_value = stats.get(challenge['type'], 10)
                         auto_check = self.should_require_roll(challenge['dc'], stat_value)
                         if not auto_check['requires_roll']:
                             challenge['auto_result'] = auto_check['outcome']
                             challenge['auto_narrative'] = auto_check['narrative']
-            
-        conn.close()
+
         return quests
 
     def get_quest_context_for_npc(self, session_id: str) -> List[Dict[str, Any]]:
         """Retrieves quests for NPC context (active, completed, failed). Excludes resolved."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM quests WHERE session_id = ? AND status IN ('active', 'completed', 'failed')", (session_id,))
-        quests = [dict(row) for row in cursor.fetchall()]
-        
+        quests = self._fetch_open_quests(session_id)
+        player_stats = None
+
         for quest in quests:
-            cursor.execute("SELECT * FROM challenges WHERE quest_id = ?", (quest['id'],))
-            challenges = [dict(row) for row in cursor.fetchall()]
-            
             # Inject auto-resolution status for context
             if quest['status'] == 'active':
-                player_stats = self.get_player_stats(session_id)
-                for ch in challenges:
+                if player_stats is None:
+                    player_stats = self.get_player_stats(session_id)
+                for ch in quest['challenges']:
                     if not ch['completed']:
-                        stat_key = ch['type'].lower()
-                        player_stat = player_stats.get(stat_key, 10)
+                        player_stat = player_stats.get(ch['type'], 10)
                         resolution = self.should_require_roll(ch['dc'], player_stat)
                         ch.update(resolution)
-                        
-            quest['challenges'] = challenges
-            quest['involved_entities'] = json.loads(quest['involved_entities']) if quest['involved_entities'] else []
-            
-        conn.close()
+
+        return quests
+
+    def _fetch_open_quests(self, session_id: str) -> List[Dict[str, Any]]:
+        """Loads active/completed/failed quests with their challenges, two queries in total."""
+        with self._lock:
+            quests = _fetch_dicts(self._conn.execute(SQL_SELECT_OPEN_QUESTS, (session_id,)))
+            challenges = _fetch_dicts(self._conn.execute(SQL_SELECT_OPEN_QUEST_CHALLENGES, (session_id,)))
+
+        by_quest = defaultdict(list)
+        for challenge in challenges:
+            by_quest[challenge['quest_id']].append(challenge)
+        for quest in quests:
+            quest['challenges'] = by_quest.get(quest['id'], [])
+            quest['involved_entities'] = orjson.loads(quest['involved_entities']) if quest['involved_entities'] else []
         return quests
 
     def resolve_quest(self, session_id: str, quest_id: str):
         """Marks a quest as resolved (turned in)."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE quests SET status = 'resolved' WHERE id = ? AND session_id = ?", (quest_id, session_id))
-        conn.commit()
-        conn.close()
+        with self._lock:
+            self._conn.execute("UPDATE quests SET status = 'resolved' WHERE id = ? AND session_id = ?", (quest_id, session_id))
 
     def clear_dead_quests(self, session_id: str):
         """Force-resolves all quests that are 'completed' or 'failed'."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE quests SET status = 'resolved' WHERE session_id = ? AND status IN ('completed', 'failed')", (session_id,))
-        count = cursor.rowcount
-        conn.commit()
-        conn.close()
-        return count
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE quests SET status = 'resolved' WHERE session_id = ? AND status IN ('completed', 'failed')", (session_id,)
+            )
+            return cursor.rowcount
 
     def resolve_challenge(self, session_id: str, challenge_id: str) -> Dict[str, Any]:
         """Resolves a challenge with dice mechanics."""
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Get Challenge
-        cursor.execute("SELECT * FROM challenges WHERE id = ? AND session_id = ?", (challenge_id, session_id))
-        challenge_row = cursor.fetchone()
-        
-        if not challenge_row:
-            conn.close()
-            return {"error": "Challenge not found"}
-            
-        challenge = dict(challenge_row)
-        
-        # Get Stats
-        stats = self.get_player_stats(session_id)
-        stat_bonus = stats.get(challenge['type'].lower(), 0) # Raw score as bonus for now, or (score-10)//2
+        # Get Challenge and Stats under one hold of the connection lock
+        with self._lock:
+            cursor = self._conn.execute(SQL_SELECT_CHALLENGE, (challenge_id, session_id))
+            challenge = _fetch_dict(cursor)
+            if challenge is None:
+                return {"error": "Challenge not found"}
+            stats = self.get_player_stats(session_id)
+
+        stat_bonus = stats.get(challenge['type'], 0) # Raw score as bonus for now, or (score-10)//2
         # User said: "Success Threshold (dice roll + stat vs. DC)" - implying raw stat? 
         # "strength: 5" in example. D&D usually is modifier. 
         # But user example: "strength": 5. 
         # Let's assume raw stat for simplicity as per user prompt "roll(1d20) + player.stats[challenge_type]".
         
+        # The relationship change and the challenge/quest updates commit (or roll back) together
+        try:
+            with self._transaction() as conn:
+                result = self._roll_challenge(session_id, challenge, stat_bonus)
+
+                # Mark the challenge done; RETURNING hands back its quest without a second lookup
+                quest_id = conn.execute(
+                    SQL_COMPLETE_CHALLENGE,
+                    (True, orjson.dumps(result).decode(), result['success'], result['severity'], challenge_id)
+                ).fetchone()[0]
+                
+                # Close the quest in the same statement once nothing is left unfinished
+                conn.execute(SQL_CLOSE_QUEST, {"quest_id": quest_id})
+        except Exception:
+            # The relationship write may already be in the session cache
+            self._invalidate_session(session_id)
+            raise
+        
+        return result
+
+    def resolve_many(self, session_id: str, challenge_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Resolves several challenges at once. Returns results keyed by challenge id.
+
+        Unknown ids get the same error dict as resolve_challenge. All writes share one transaction.
+        """
+        with self._lock:
+            cursor = self._conn.execute(SQL_SELECT_CHALLENGES, (session_id, orjson.dumps(challenge_ids).decode()))
+            challenges = _fetch_dicts(cursor)
+
+        results: Dict[str, Dict[str, Any]] = {cid: {"error": "Challenge not found"} for cid in challenge_ids}
+        if not challenges:
+            return results
+
+        stats = self.get_player_stats(session_id)
+        try:
+            with self._transaction() as conn:
+                rows = []
+                for challenge in challenges:
+                    result = self._roll_challenge(session_id, challenge, stats.get(challenge['type'], 0))
+                    results[challenge['id']] = result
+                    rows.append((True, orjson.dumps(result).decode(), result['success'], result['severity'], challenge['id']))
+                conn.executemany(SQL_COMPLETE_CHALLENGES, rows)
+                quest_ids = dict.fromkeys(c['quest_id'] for c in challenges)
+                conn.executemany(SQL_CLOSE_QUEST, [{"quest_id": q} for q in quest_ids])
+        except Exception:
+            self._invalidate_session(session_id)
+            raise
+
+        return results
+
+    def _roll_challenge(self, session_id: str, challenge: Dict[str, Any], stat_bonus: int) -> Dict[str, Any]:
+        """Rolls (or auto-resolves) a challenge and applies the quest giver's relationship change."""
         # Auto-Resolution Check
         auto_check = self.should_require_roll(challenge['dc'], stat_bonus)
         
@@ -1375,7 +2052,7 @@ class GameStateManager:
             }
             # Relationship Update for Auto-Success
             if success:
-                self.update_relationship(session_id, self.get_quest_giver(session_id, challenge['quest_id']), "auto_success")
+                self.update_relationship(session_id, challenge['giver_npc'], "auto_success")
         else:
             import random
             roll = random.randint(1, 20)
@@ -1393,7 +2070,7 @@ class GameStateManager:
                 severity = self.calculate_failure_severity(total, challenge['dc'], roll == 1)
             
             # Relationship Update based on Outcome
-            giver_name = self.get_quest_giver(session_id, challenge['quest_id'])
+            giver_name = challenge['giver_npc']
             if giver_name:
                 if success:
                     self.update_relationship(session_id, giver_name, "roll_success")
@@ -1415,68 +2092,81 @@ class GameStateManager:
                 "critical_failure": roll == 1,
                 "severity": severity
             }
-        
-        # Update Challenge
-        cursor.execute('''
-            UPDATE challenges 
-            SET completed = ?, result = ? 
-            WHERE id = ?
-        ''', (True, json.dumps(result), challenge_id))
-        
-        conn.commit()
-        
-        # Check if all challenges for this quest are completed
-        quest_id = challenge['quest_id']
-        cursor.execute("SELECT COUNT(*) FROM challenges WHERE quest_id = ? AND completed = 0", (quest_id,))
-        remaining = cursor.fetchone()[0]
-        
-        if remaining == 0:
-            # All challenges completed! Check results.
-            cursor.execute("SELECT result FROM challenges WHERE quest_id = ?", (quest_id,))
-            results = cursor.fetchall()
-            
-            any_failure = False
-            for res_row in results:
-                if res_row[0]:
-                    res_dict = json.loads(res_row[0])
-                    if not res_dict.get('success', False):
-                        any_failure = True
-                        break
-            
-            new_status = 'failed' if any_failure else 'completed'
-            cursor.execute("UPDATE quests SET status = ? WHERE id = ?", (new_status, quest_id))
-            conn.commit()
-            
-        conn.close()
-        
+
         return result
 
     def process_involved_entities(self, session_id: str, entities: List[str]):
-        """Checks if entities exist, creates stubs if not."""
+        """Checks if entities exist, queues stubs for the stub writer if not."""
         # 1. Check Game World (Static)
-        # 2. Check NPC States (Dynamic)
-        # 3. Check Entity Stubs (Dynamic)
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        for entity_id in entities:
-            # Check if known in game world
-            if game_world.get_character(entity_id) or game_world.get_location(entity_id):
-                continue
-                
-            # Check if exists in stubs
-            cursor.execute("SELECT 1 FROM entity_stubs WHERE id = ? AND session_id = ?", (entity_id, session_id))
-            if cursor.fetchone():
-                continue
-                
-            # Create Stub
-            stub_name = entity_id.replace("_", " ").title()
-            cursor.execute('''
-                INSERT INTO entity_stubs (id, session_id, name, type, status, needs_expansion)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (entity_id, session_id, stub_name, "unknown", "mentioned", True))
-            logger.info(f"Created entity stub for: {entity_id}")
-            
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        # 2. Check Entity Stubs (Dynamic) - done by the writer thread, see _write_stubs
+        
+        static_ids = game_world.static_ids()
+        with self._lock:
+            known = self._stub_cache.get(session_id)
+            if known is None:
+                known = self._stub_cache[session_id] = {row[0] for row in self._conn.execute(SQL_SELECT_STUB_IDS, (session_id,))}
+            queued = self._queued_stubs.get(session_id, ())
+            for entity_id in dict.fromkeys(entities):
+                if entity_id in static_ids or entity_id in known or entity_id in queued:
+                    continue
+                self._queued_stubs.setdefault(session_id, set()).add(entity_id)
+                self._stub_queue.put_nowait((session_id, entity_id))
+
+    def flush_stubs(self):
+        """Blocks until every queued entity stub has been written."""
+        self._stub_queue.join()
+
+    def _run_stub_writer(self):
+        """Drains the stub queue until close() queues None, writing each batch in one transaction."""
+        stopping = False
+        while not stopping:
+            entry = self._stub_queue.get()
+            if entry is None:
+                self._stub_queue.task_done()
+                return
+            batch = [entry]
+            deadline = time.monotonic() + STUB_FLUSH_INTERVAL
+            while len(batch) < STUB_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self._stub_queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._stub_queue.task_done()
+                    stopping = True
+                    break
+                batch.append(entry)
+            try:
+                self._write_stubs(batch)
+            except Exception:
+                logger.exception("Failed to write %d entity stubs", len(batch))
+            finally:
+                with self._lock:
+                    for session_id, entity_id in batch:
+                        queued = self._queued_stubs.get(session_id)
+                        if queued is not None:
+                            queued.discard(entity_id)
+                            if not queued:
+                                del self._queued_stubs[session_id]
+                for _ in batch:
+                    self._stub_queue.task_done()
+
+    def _write_stubs(self, batch: List[Tuple[str, str]]):
+        """Inserts stubs for the queued ids that do not have one yet."""
+        # OR IGNORE skips ids that already have a row, so no existence check is needed first;
+        # the cursor's rowcount says how many were actually inserted
+        rows = [(e, session_id, e.replace("_", " ").title(), "unknown", "mentioned", True) for session_id, e in batch]
+        with self._transaction() as conn:
+            created = conn.executemany(SQL_INSERT_STUB, rows).rowcount
+        # Only trust the ids once the transaction has committed
+        with self._lock:
+            for session_id, entity_id in batch:
+                # Sessions not loaded yet (or forgotten since) read the row from the table later
+                known = self._stub_cache.get(session_id)
+                if known is not None:
+                    known.add(entity_id)
+        if created:
+            logger.info("Created %d entity stubs", created)
@@ -1,47 +1,119 @@
 import os
 import json
 import logging
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
+import orjson
 from pydantic import ValidationError
 
-from .models import GameWorldData, Location, Character
+from .models import GameWorldData, Location, Character, Feature
 
 logger = logging.getLogger(__name__)
 
+# file path -> (mtime_ns, decoded JSON), so reloading an unchanged world file skips the read and decode.
+# Models are still built on every load, so each GameWorld gets its own Location/Character objects.
+_world_file_cache: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+
+
+def _load_world_file(file_path: str) -> Dict[str, Any]:
+    mtime_ns = os.stat(file_path).st_mtime_ns
+    cached = _world_file_cache.get(file_path)
+    if cached is None or cached[0] != mtime_ns:
+        with open(file_path, 'rb') as f:
+            cached = _world_file_cache[file_path] = (mtime_ns, orjson.loads(f.read()))
+    return cached[1]
+
+
+def _construct_world_data(data: Dict[str, Any]) -> GameWorldData:
+    """Builds the model tree without validation; only for author-controlled world files."""
+    locations = []
+    for loc in data["locations"]:
+        loc = dict(loc)
+        loc["features"] = [Feature.model_construct(**f) for f in loc.get("features", [])]
+        loc["characters"] = [Character.model_construct(**c) for c in loc.get("characters", [])]
+        locations.append(Location.model_construct(**loc))
+    return GameWorldData.model_construct(world=data["world"], description=data["description"], locations=locations)
+
+
+# Debug NPC "The Architect", injected into every world. Literal data, so it skips validation.
+ARCHITECT = Character.model_construct(
+    name="The Architect",
+    race="Digital Entity",
+    occupation="System Administrator",
+    description="A figure composed of shifting geometric light, observing the world with detached interest.",
+    short_description="A debug entity aware of the simulation.",
+    personality_prompt="You are The Architect, a debug entity aware that this is a simulation. You are helpful, concise, and omnipotent. You exist to test the system. If the player asks for a quest, give one immediately with specific mechanics they request. If they ask for items, grant them. Do not roleplay a fantasy character; roleplay a system administrator.",
+    resource_level="opulent",
+    x=1,
+    y=1
+)
+
 
 class GameWorld:
     def __init__(self):
         self.name: str | None = None
+        # Bumped by initialize_game_world, so state derived from the previous world can be dropped
+        self.generation = 0
         self.locations: Dict[str, Location] = {}
         self.characters: Dict[str, Dict[str, Character]] = {}
+        # Where new sessions start: the first location added
+        self.first_location_name: str | None = None
+        self._static_ids: frozenset[str] | None = None
+        self._feature_by_char: Dict[str, Dict[str, Feature]] = {}
+        # name -> character across all locations; the first location a name was added to wins
+        self._char_by_name: Dict[str, Character] = {}
+        # location name -> names already in that Location's characters list
+        self._char_names_by_loc: Dict[str, set[str]] = {}
 
     def add_location(self, location: Location):
         self.locations[location.name] = location
+        self._char_names_by_loc.pop(location.name, None)
+        if self.first_location_name is None:
+            self.first_location_name = location.name
+        self._static_ids = None
+        self._feature_by_char.pop(location.name, None)
 
     def add_character(self, character: Character, location_name: str):
-        if location_name not in self.characters:
-            self.characters[location_name] = {}
-        self.characters[location_name][character.name] = character
+        self.characters.setdefault(location_name, {})[character.name] = character
+        self._char_by_name.setdefault(character.name, character)
+        self._static_ids = None
         
         # Also add to the Location object's character list if it exists
         if location_name in self.locations:
             loc = self.locations[location_name]
             # Check if already in list to avoid duplicates
-            if not any(c.name == character.name for c in loc.characters):
+            names = self._char_names_by_loc.get(location_name)
+            if names is None:
+                names = self._char_names_by_loc[location_name] = {c.name for c in loc.characters}
+            if character.name not in names:
                 loc.characters.append(character)
+                names.add(character.name)
 
     def get_location(self, name: str) -> Location | None:
         return self.locations.get(name)
 
     def get_character(self, name: str, location_name: str | None = None) -> Character | None:
         if location_name:
-            return self.characters.get(location_name, {}).get(name)
+            by_name = self.characters.get(location_name)
+            return by_name.get(name) if by_name is not None else None
         else:
-            # Search all locations for the character
-            for loc_chars in self.characters.values():
-                if name in loc_chars:
-                    return loc_chars[name]
-            return None
+            return self._char_by_name.get(name)
+
+    def features_by_char(self, location: Location) -> Dict[str, Feature]:
+        """Maps each map character of a location to the feature it stands for, built once per location."""
+        index = self._feature_by_char.get(location.name)
+        if index is None:
+            by_name: Dict[str, Feature] = {}
+            for feature in location.features:
+                by_name.setdefault(feature.name, feature)
+            index = {char: by_name[name] for char, name in location.map_key.items() if name in by_name}
+            self._feature_by_char[location.name] = index
+        return index
+
+    def static_ids(self) -> frozenset[str]:
+        """Names of every location and character, rebuilt only after the world changes."""
+        if self._static_ids is None:
+            self._static_ids = frozenset(self.locations.keys() | self._char_by_name.keys())
+        return self._static_ids
 
 # Initializing the game world
 game_world = GameWorld()
@@ -50,6 +122,12 @@ def initialize_game_world(world_name: str | None = None):
     """Loads all game data and populates the game world."""
     game_world.locations = {}  # Clear existing data
     game_world.characters = {} # Clear existing data
+    game_world.first_location_name = None
+    game_world._static_ids = None
+    game_world._feature_by_char = {}
+    game_world._char_by_name = {}
+    game_world._char_names_by_loc = {}
+    game_world.generation += 1
     logger.info("Game world data cleared.")
 
     if not world_name:
@@ -60,20 +138,22 @@ def initialize_game_world(world_name: str | None = None):
     # Load from a specific world file
     file_path = os.path.join(os.path.dirname(__file__), "worlds", f"{world_name}.json")
     try:
-        with open(file_path, 'r') as f:
-            game_data_dict = json.load(f)
-        
-        # Validate and load data using Pydantic model
-        game_data = GameWorldData.parse_obj(game_data_dict)
+        game_data_dict = _load_world_file(file_path)
+
+        # Validate and load data using Pydantic model, unless the world files are trusted
+        if os.getenv("CHATRPG_TRUST_WORLD_FILES", "").lower() in {"1", "true", "yes"}:
+            game_data = _construct_world_data(game_data_dict)
+        else:
+            game_data = GameWorldData.model_validate(game_data_dict)
 
     except FileNotFoundError:
-        logger.error(f"World file not found: {file_path}")
+        logger.error("World file not found: %s", file_path)
         return None
     except json.JSONDecodeError as e:
-        logger.error(f"JSON decoding error in {world_name}.json: {e}")
+        logger.error("JSON decoding error in %s.json: %s", world_name, e)
         raise  # Re-raise the exception after logging
     except ValidationError as e:
-        logger.error(f"Validation error for world data in {world_name}.json: {e}")
+        logger.error("Validation error for world data in %s.json: %s", world_name, e)
         raise # Re-raise the exception after logging
 
     game_world.name = game_data.world
@@ -85,34 +165,24 @@ def initialize_game_world(world_name: str | None = None):
             game_world.add_character(character, location.name)
 
     # Inject Debug NPC "The Architect"
-    architect = Character(
-        name="The Architect",
-        race="Digital Entity",
-        occupation="System Administrator",
-        description="A figure composed of shifting geometric light, observing the world with detached interest.",
-        short_description="A debug entity aware of the simulation.",
-        personality_prompt="You are The Architect, a debug entity aware that this is a simulation. You are helpful, concise, and omnipotent. You exist to test the system. If the player asks for a quest, give one immediately with specific mechanics they request. If they ask for items, grant them. Do not roleplay a fantasy character; roleplay a system administrator.",
-        resource_level="opulent",
-        x=1,
-        y=1
-    )
     # Add to Oakhaven (or the first location if Oakhaven doesn't exist, but we assume it does for now)
-    logger.info(f"Available locations: {list(game_world.locations.keys())}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Available locations: %s", list(game_world.locations.keys()))
     if "Oakhaven" in game_world.locations:
-        game_world.add_character(architect, "Oakhaven")
+        game_world.add_character(ARCHITECT, "Oakhaven")
         logger.info("The Architect has been added to Oakhaven.")
     else:
         # Fallback to first location
         if game_world.locations:
-            first_loc = list(game_world.locations.keys())[0]
-            game_world.add_character(architect, first_loc)
-            logger.info(f"The Architect has been added to {first_loc} (Fallback).")
+            first_loc = game_world.first_location_name
+            game_world.add_character(ARCHITECT, first_loc)
+            logger.info("The Architect has been added to %s (Fallback).", first_loc)
         else:
             logger.error("No locations found to add The Architect!")
 
     if game_world.locations:
-        first_location_name = list(game_world.locations.keys())[0]
-        logger.info(f"First location loaded: {first_location_name}")
+        first_location_name = game_world.first_location_name
+        logger.info("First location loaded: %s", first_location_name)
         return first_location_name
     else:
         logger.warning("No locations loaded into the game world.")
@@ -7,12 +7,19 @@ from google.genai import types
 
 logger = logging.getLogger(__name__)
 
+client = genai.Client()
+
+# Image MIME type -> the file extension it can be saved under without transcoding
+MIME_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+}
+
 def generate_and_save_image(prompt: str, output_path: str) -> bool:
     try:
-        client = genai.Client()
-        
-        logger.info(f"Attempting to generate image for prompt: '{prompt}' "
-                    "using Gemini API.")
+        logger.info("Attempting to generate image for prompt: '%s' "
+                    "using Gemini API.", prompt)
         
         response = client.models.generate_content(
             model="gemini-2.0-flash-preview-image-generation",
@@ -32,15 +39,20 @@ def generate_and_save_image(prompt: str, output_path: str) -> bool:
             logger.warning("Gemini API image generation returned no image data.")
             return False
 
-        img_byte_arr = io.BytesIO(image_part.inline_data.data)
-        img = Image.open(img_byte_arr)
-
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        img.save(output_path)
-        logger.info(f"Image saved to {output_path}")
+        ext = os.path.splitext(output_path)[1].lower()
+        if MIME_EXTENSIONS.get(image_part.inline_data.mime_type) == ext:
+            # Already in the target format; write the bytes as-is instead of decoding and re-encoding
+            with open(output_path, "wb") as f:
+                f.write(image_part.inline_data.data)
+        else:
+            img_byte_arr = io.BytesIO(image_part.inline_data.data)
+            img = Image.open(img_byte_arr)
+            img.save(output_path)
+        logger.info("Image saved to %s", output_path)
         return True
 
     except Exception as e:
-        logger.error(f"Error during Gemini API image generation or saving: "
-                    f"{type(e).__name__}: {e}")
+        logger.error("Error during Gemini API image generation or saving: "
+                    "%s: %s", type(e).__name__, e)
         return False
\ No newline at end of file
@@ -3,7 +3,7 @@ from google import genai
 from google.genai import types
 from typing import List, Dict, Tuple, Any
 import logging
-import json
+import orjson
 import re
 from .models import GameWorldData
 from pydantic import ValidationError
@@ -17,61 +17,109 @@ if not API_KEY:
 
 client = genai.Client(api_key=API_KEY)
 
+_JSON_FENCE_RE = re.compile(r"```json(.*?)```", re.DOTALL)
+_FENCE_RE = re.compile(r"```(.*?)```", re.DOTALL)
+# Characters that matter when walking a raw JSON object; everything else is skipped by the regex engine
+_JSON_STRUCTURE_RE = re.compile(r'[{}"\\]')
+
+def _find_json_span(text: str, pos: int = 0) -> Tuple[int, int] | None:
+    """Returns the span of the first balanced {...} object in text[pos:], ignoring braces inside strings."""
+    start = text.find("{", pos)
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escaped_pos = -1
+    for token in _JSON_STRUCTURE_RE.finditer(text, start):
+        pos = token.start()
+        if pos == escaped_pos:
+            continue
+        ch = token.group()
+        if in_string:
+            if ch == "\\":
+                escaped_pos = pos + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return start, pos + 1
+    return None
+
 def extract_json_metadata(text: str) -> Tuple[str, Dict[str, Any]]:
     """Extracts a JSON object from a string and returns the remaining text and
     the parsed JSON."""
-    # 1. Try strict markdown with json tag
-    json_pattern = re.compile(r"```json(.*?)```", re.DOTALL)
-    match = json_pattern.search(text)
-    
-    # 2. Try generic markdown
-    if not match:
-        json_pattern = re.compile(r"```(.*?)```", re.DOTALL)
-        match = json_pattern.search(text)
-
-    # 3. Try raw JSON (first { to last })
-    if not match:
-        json_pattern = re.compile(r"(\{.*\})", re.DOTALL)
-        match = json_pattern.search(text)
-
+    # Plain dialogue has neither a fence nor a brace; skip the regex passes entirely
+    has_fence = "```" in text
+    has_brace = "{" in text
+    if not has_fence and not has_brace:
+        return text, {}
+
+    match = None
+    if has_fence:
+        # 1. Try strict markdown with json tag
+        match = _JSON_FENCE_RE.search(text)
+
+        # 2. Try generic markdown
+        if not match:
+            match = _FENCE_RE.search(text)
+
+    span = None
     metadata = {}
-    dialogue = text
+    try:
+        if match:
+            metadata = orjson.loads(match.group(1).strip())
+            span = match.span()
+        # 3. Try raw JSON: the first balanced object that decodes, so a {...} in the dialogue is skipped
+        elif has_brace:
+            candidate = _find_json_span(text)
+            while candidate:
+                try:
+                    metadata = orjson.loads(text[candidate[0]:candidate[1]])
+                    span = candidate
+                    break
+                except orjson.JSONDecodeError:
+                    next_candidate = _find_json_span(text, candidate[1])
+                    if next_candidate is None:
+                        raise
+                    candidate = next_candidate
+    except orjson.JSONDecodeError as e:
+        logger.warning(
+            "Failed to decode JSON from Gemini response: %s", e
+        )
+        # If JSON is malformed, treat the whole thing as dialogue
+        metadata = {}
 
-    if match:
-        json_str = match.group(1).strip()
-        try:
-            metadata = json.loads(json_str)
-            # If the JSON contains a 'dialogue' field, use it as the primary dialogue
-            if "dialogue" in metadata:
-                dialogue = metadata["dialogue"]
-            else:
-                # Otherwise, remove the JSON block from the original text
-                dialogue = json_pattern.sub("", text).strip()
-        except json.JSONDecodeError as e:
-            logger.warning(
-                f"Failed to decode JSON from Gemini response: {e}"
-            )
-            # If JSON is malformed, treat the whole thing as dialogue
-            metadata = {}
+    dialogue = text
+    if span:
+        # If the JSON contains a 'dialogue' field, use it as the primary dialogue
+        if "dialogue" in metadata:
+            dialogue = metadata["dialogue"]
+        else:
+            # Otherwise, cut the JSON block out of the original text
+            start, end = span
+            dialogue = (text[:start] + text[end:]).strip()
 
     return dialogue, metadata
 
 async def get_gemini_response(conversation_history: List[Dict],
                                 system_instruction: str = None) -> Tuple[str, Dict[str, Any]]:
     try:
-        formatted_history = []
-        for entry in conversation_history:
-            formatted_parts = [
-                types.Part(text=part_text)
-                for part_text in entry["parts"]
-            ]
-            formatted_history.append(types.Content(role=entry["role"], parts=formatted_parts))
+        # The SDK accepts plain dicts for contents, so skip building Content/Part models
+        formatted_history = [
+            {"role": entry["role"], "parts": [{"text": part_text} for part_text in entry["parts"]]}
+            for entry in conversation_history
+        ]
 
         config = None
         if system_instruction:
             config = types.GenerateContentConfig(system_instruction=system_instruction)
 
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-flash-latest",
             contents=formatted_history,
             config=config
@@ -81,32 +129,33 @@ async def get_gemini_response(conversation_history: List[Dict],
         return dialogue, metadata
     except Exception as e:
         logger.error(
-            f"Error calling Gemini API for text generation: "
-            f"{type(e).__name__}: {e}"
+            "Error calling Gemini API for text generation: "
+            "%s: %s", type(e).__name__, e
         )
         return "I'm sorry, I seem to be having trouble responding right now.", {}
 
-async def generate_game_data(request: str) -> Dict[str, Any]:
-    """Generates new game data using the Gemini API and the prompt template.
-    """
-    try:
-        # Generate the prompt template dynamically from the Pydantic model
-        json_schema_template = GameWorldData.schema_json(indent=2)
-        prompt_template = f"""
+# The schema only changes with the model, so generate it once rather than per request
+GAME_WORLD_SCHEMA_JSON = orjson.dumps(GameWorldData.model_json_schema(), option=orjson.OPT_INDENT_2).decode()
+GAME_WORLD_PROMPT_TEMPLATE = f"""
 You are a creative assistant for a text-based adventure game. Your task is to generate data for a new game world, including locations and characters. The output must be in JSON format, following the template provided below. You must always include at least one location, and each location must have a 'characters' array, even if it's empty. Each location must also have an ASCII map with a key, an initial player starting point, and at least one entrance/exit.
 
 **Game World Template (JSON Schema):**
 
 ```json
-{json_schema_template}
+{GAME_WORLD_SCHEMA_JSON}
 ```
 
 Please generate new game data based on the following request:
 
 [INSERT REQUEST HERE]
 """
+
+async def generate_game_data(request: str) -> Dict[str, Any]:
+    """Generates new game data using the Gemini API and the prompt template.
+    """
+    try:
         # Fill in the request
-        prompt = prompt_template.replace("[INSERT REQUEST HERE]", request)
+        prompt = GAME_WORLD_PROMPT_TEMPLATE.replace("[INSERT REQUEST HERE]", request)
 
         # Call the Gemini API
         generation_config = types.GenerationConfig(
@@ -125,7 +174,7 @@ Please generate new game data based on the following request:
             {"category": "HARM_CATEGORY_DANGEROUS_CONTENT",
              "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
         ]
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-flash-latest",
             contents=prompt,
             generation_config=generation_config,
@@ -135,33 +184,45 @@ Please generate new game data based on the following request:
         # Extract and return the JSON data
         _, metadata = extract_json_metadata(response.text)
         try:
-            validated_data = GameWorldData.parse_obj(metadata)
-            return validated_data.dict()
+            validated_data = GameWorldData.model_validate(metadata)
+            return validated_data.model_dump()
         except ValidationError as e:
-            logger.error(f"Generated game data failed Pydantic validation: {e}")
+            logger.error("Generated game data failed Pydantic validation: %s", e)
             return {}
     except Exception as e:
         logger.error(
-            f"Error calling Gemini API for game data generation: "
-            f"{type(e).__name__}: {e}"
+            "Error calling Gemini API for game data generation: "
+            "%s: %s", type(e).__name__, e
         )
         return {}
 
+# Normalised item name -> generated description. Insertion-ordered, so the oldest entry is evicted first.
+ITEM_DETAILS_CACHE_SIZE = 512
+_item_details_cache: Dict[str, str] = {}
+
 async def generate_item_details(item_name: str) -> str:
     """Generates a creative description for an item."""
+    key = item_name.strip().lower()
+    cached = _item_details_cache.get(key)
+    if cached is not None:
+        return cached
     try:
         prompt = f"""
         Describe the item '{item_name}' for a fantasy RPG.
         Include its appearance, potential magical properties, and a bit of lore.
         Keep it concise (under 100 words).
         """
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-flash-latest",
             contents=prompt
         )
-        return response.text.strip()
+        details = response.text.strip()
+        if len(_item_details_cache) >= ITEM_DETAILS_CACHE_SIZE:
+            del _item_details_cache[next(iter(_item_details_cache))]
+        _item_details_cache[key] = details
+        return details
     except Exception as e:
-        logger.error(f"Error generating item details: {e}")
+        logger.error("Error generating item details: %s", e)
         return f"A simple {item_name}."
 
 async def generate_quest(context: str) -> str:
@@ -173,13 +234,13 @@ async def generate_quest(context: str) -> str:
         The quest should be something they can start immediately.
         Keep it concise (under 50 words).
         """
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-flash-latest",
             contents=prompt
         )
         return response.text.strip()
     except Exception as e:
-        logger.error(f"Error generating quest: {e}")
+        logger.error("Error generating quest: %s", e)
         return "You hear rumors of trouble nearby, but nothing specific."
 
 async def generate_npc_memory_update(conversation_history: List[Dict], 
@@ -190,17 +251,16 @@ async def generate_npc_memory_update(conversation_history: List[Dict],
     """Generates a memory update and new greetings for an NPC based on a conversation."""
     try:
         # Format conversation for the prompt
-        formatted_convo = ""
-        for entry in conversation_history:
-            role = "Player" if entry["role"] == "user" else npc_name
-            text = " ".join(entry["parts"])
-            formatted_convo += f"{role}: {text}\n"
+        formatted_convo = "".join(
+            f"{'Player' if entry['role'] == 'user' else npc_name}: {' '.join(entry['parts'])}\n"
+            for entry in conversation_history
+        )
 
         prompt = f"""
         Analyze the following conversation between {npc_name} and {player_name}.
         
-        Current Memory of {npc_name}: {json.dumps(current_memory)}
-        Current Greetings: {json.dumps(current_greetings)}
+        Current Memory of {npc_name}: {orjson.dumps(current_memory).decode()}
+        Current Greetings: {orjson.dumps(current_greetings).decode()}
         
         Conversation:
         {formatted_convo}
@@ -226,7 +286,7 @@ async def generate_npc_memory_update(conversation_history: List[Dict],
         ALWAYS return updated_memory (even if it's just the old memory) and new_greetings.
         """
         
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-flash-latest",
             contents=prompt
         )
@@ -234,7 +294,7 @@ async def generate_npc_memory_update(conversation_history: List[Dict],
         _, metadata = extract_json_metadata(response.text)
         return metadata
     except Exception as e:
-        logger.error(f"Error generating NPC memory update: {e}")
+        logger.error("Error generating NPC memory update: %s", e)
         return {}
 
 ANTI_YES_AND_RULES = """
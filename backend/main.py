@@ -96,6 +96,26 @@ game_state_manager = GameStateManager()
 # Initialize the game world data
 initialize_game_world("Elodia")
 
+# Background Gemini work (portraits, memory updates). The event loop only holds weak
+# references to tasks, so keep them here until they finish.
+_background_tasks: set = set()
+# npc_id -> in-flight portrait task, so repeat triggers share one generation
+_portrait_tasks: Dict[str, Any] = {}
+
+def _spawn_background(coro):
+    import asyncio
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def _trigger_portrait_generation(npc_id: str):
+    if npc_id in _portrait_tasks:
+        return
+    task = _spawn_background(get_npc_portrait(npc_id))
+    _portrait_tasks[npc_id] = task
+    task.add_done_callback(lambda _: _portrait_tasks.pop(npc_id, None))
+
 # --- Pydantic Models ---
 
 class UserInput(BaseModel):
@@ -130,7 +150,7 @@ class NPCResponse(BaseModel):
 
 @app.post("/interact", response_model=NPCResponse)
 async def interact_with_npc(user_input: UserInput):
-    logger.info(f"Received user input: {user_input.dict()}")
+    logger.info(f"Received user input: {user_input.model_dump()}")
     session_id = user_input.session_id
     
     if not game_state_manager.session_exists(session_id):
@@ -174,7 +194,7 @@ async def interact_with_npc(user_input: UserInput):
         
         # Add to history
         conversation_history.append({"role": "model", "parts": [greeting]})
-        game_state_manager.update_conversation_history(session_id, conversation_history)
+        game_state_manager.append_conversation_turn(session_id, "model", greeting)
         
         # Portrait Logic
         portrait_path = f"frontend/portraits/{npc_id}.png"
@@ -184,8 +204,7 @@ async def interact_with_npc(user_input: UserInput):
         else:
             logger.info(f"Portrait for {npc_id} not found. Triggering generation...")
             # Async generation trigger
-            import asyncio
-            asyncio.create_task(get_npc_portrait(npc_id))
+            _trigger_portrait_generation(npc_id)
 
         return NPCResponse(
             session_id=session_id,
@@ -330,7 +349,7 @@ async def interact_with_npc(user_input: UserInput):
 
     game_state_manager.process_metadata(session_id, metadata)
     conversation_history.append({"role": "model", "parts": [gemini_dialogue]})
-    game_state_manager.update_conversation_history(session_id, conversation_history)
+    game_state_manager.append_conversation_turns(session_id, [("user", user_input.message), ("model", gemini_dialogue)])
     logger.info(f"Conversation history after adding Gemini response: {conversation_history}")
 
     
@@ -380,8 +399,6 @@ class ResolveChallengeInput(BaseModel):
 from fastapi import BackgroundTasks
 
 def update_history_background(session_id: str, result: Dict[str, Any]):
-    history = game_state_manager.get_conversation_history(session_id)
-    
     severity_note = ""
     if not result.get('success'):
         severity_note = f" (Severity: {result.get('severity', 'Unknown')})"
@@ -389,8 +406,7 @@ def update_history_background(session_id: str, result: Dict[str, Any]):
         severity_note = " (Auto-Success)"
         
     system_note = f"[System] Player resolved challenge '{result.get('description', 'Unknown')}' with result: {'Success' if result.get('success') else 'Failure'}{severity_note}."
-    history.append({"role": "user", "parts": [system_note]})
-    game_state_manager.update_conversation_history(session_id, history)
+    game_state_manager.append_conversation_turn(session_id, "user", system_note)
 
 @app.post("/resolve_challenge")
 async def resolve_challenge_endpoint(input: ResolveChallengeInput, background_tasks: BackgroundTasks):
@@ -437,16 +453,9 @@ async def resolve_skill_check_endpoint(input: SkillCheckInput):
     }
     
     # Update History
-    history = game_state_manager.get_conversation_history(input.session_id)
-    
-    # Add system note about the roll (so LLM knows what happened next time)
+    # Add system note about the roll (so LLM knows what happened next time), then the NPC response
     system_note = f"[System] Player rolled {roll} + {stat_bonus} = {total} vs DC {input.dc} on {input.description}. Result: {'Success' if success else 'Failure'}."
-    history.append({"role": "user", "parts": [system_note]})
-    
-    # Add NPC response
-    history.append({"role": "model", "parts": [response_text]})
-    
-    game_state_manager.update_conversation_history(input.session_id, history)
+    game_state_manager.append_conversation_turns(input.session_id, [("user", system_note), ("model", response_text)])
     
     return result
 
@@ -498,9 +507,7 @@ async def accept_quest_endpoint(input: QuestDecisionInput):
     response_text = game_state_manager.accept_quest(input.session_id, input.quest_id)
     
     # Update conversation history so NPC remembers saying this
-    history = game_state_manager.get_conversation_history(input.session_id)
-    history.append({"role": "model", "parts": [response_text]})
-    game_state_manager.update_conversation_history(input.session_id, history)
+    game_state_manager.append_conversation_turn(input.session_id, "model", response_text)
     
     return {"status": "success", "message": "Quest accepted", "npc_response": response_text}
 
@@ -510,9 +517,7 @@ async def refuse_quest_endpoint(input: QuestDecisionInput):
     response_text = game_state_manager.refuse_quest(input.session_id, input.quest_id)
     
     # Update conversation history so NPC remembers saying this
-    history = game_state_manager.get_conversation_history(input.session_id)
-    history.append({"role": "model", "parts": [response_text]})
-    game_state_manager.update_conversation_history(input.session_id, history)
+    game_state_manager.append_conversation_turn(input.session_id, "model", response_text)
     
     return {"status": "success", "message": "Quest refused", "npc_response": response_text}
 
@@ -520,7 +525,7 @@ async def refuse_quest_endpoint(input: QuestDecisionInput):
 
 @app.post("/command", response_model=NPCResponse)
 async def handle_command(command_input: CommandInput):
-    logger.info(f"Received command input: {command_input.dict()}")
+    logger.info(f"Received command input: {command_input.model_dump()}")
     session_id = command_input.session_id
 
     if not game_state_manager.session_exists(session_id):
@@ -566,9 +571,7 @@ async def handle_command(command_input: CommandInput):
                 greeting_text = str(greeting)
             
             # Add to history so it's consistent
-            conversation_history = game_state_manager.get_conversation_history(session_id)
-            conversation_history.append({"role": "model", "parts": [greeting_text]})
-            game_state_manager.update_conversation_history(session_id, conversation_history)
+            game_state_manager.append_conversation_turn(session_id, "model", greeting_text)
             
             # Override response text with the greeting
             command_response_text = greeting_text
@@ -577,8 +580,7 @@ async def handle_command(command_input: CommandInput):
             portrait_path = f"frontend/portraits/{npc_id}.png"
             if not os.path.exists(portrait_path):
                 logger.info(f"Portrait for {npc_id} not found. Triggering generation...")
-                import asyncio
-                asyncio.create_task(get_npc_portrait(npc_id))
+                _trigger_portrait_generation(npc_id)
 
     # Check if command was "leave" or "exit" to trigger memory update
     if command_input.command.lower() in ["leave", "exit", "bye", "goodbye"]:
@@ -657,8 +659,7 @@ async def handle_command(command_input: CommandInput):
         # Archive/Clear History IMMEDIATELY to prevent race conditions
         game_state_manager.archive_conversation(session_id)
         
-        import asyncio
-        asyncio.create_task(update_memory_task())
+        _spawn_background(update_memory_task())
 
     npcs_in_location = game_state_manager.get_npcs_in_location(session_id)
 
@@ -701,7 +702,7 @@ class StartGameInput(BaseModel):
 
 @app.post("/start", response_model=NPCResponse)
 async def start_game(start_input: StartGameInput):
-    logger.info(f"Received start game input: {start_input.dict()}")
+    logger.info(f"Received start game input: {start_input.model_dump()}")
     session_id = start_input.session_id or str(uuid.uuid4())
     
     if game_state_manager.session_exists(session_id):
@@ -767,7 +768,9 @@ async def get_npc_portrait(npc_id: str):
         f"The image should be a 3d rendered, high-quality, realistic portrait "         f"suitable for a fantasy RPG."
     )
     
-    success = generate_and_save_image(image_prompt, portrait_path)
+    # The image client is synchronous; run it off the event loop
+    import asyncio
+    success = await asyncio.to_thread(generate_and_save_image, image_prompt, portrait_path)
     if not success:
         raise HTTPException(status_code=500,
                             detail="Error generating or saving portrait.")
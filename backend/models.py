@@ -1,7 +1,9 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Dict, Any, Optional
 
 class Feature(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     name: str
     description: str
 
@@ -28,6 +30,8 @@ class Quest(BaseModel):
     challenges: List[Challenge] = []
 
 class Character(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     name: str
     race: str
     occupation: str
@@ -39,6 +43,8 @@ class Character(BaseModel):
     short_description: str = Field(..., description="A brief, one-sentence description of the character for quick reference.")
 
 class Location(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     name: str
     description: str
     raw_layout: List[str]
@@ -49,6 +55,8 @@ class Location(BaseModel):
     characters: List[Character] = []
 
 class GameWorldData(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     world: str
     description: str
     locations: List[Location]
@@ -0,0 +1,15 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Set a dummy API key and, when the SDK is not installed, mock google.genai so gemini_service imports offline
+os.environ.setdefault("GEMINI_API_KEY", "test_key")
+try:
+    from google import genai  # noqa: F401
+except ImportError:
+    sys.modules["google"] = MagicMock()
+    sys.modules["google.genai"] = MagicMock()
+    sys.modules["google.genai.types"] = MagicMock()
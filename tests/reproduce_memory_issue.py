@@ -49,11 +49,7 @@ async def test_memory_update_flow():
     print("Interaction started.")
     
     # 4. Add some history
-    history = [
-        {"role": "user", "parts": ["Hello Brom"]},
-        {"role": "model", "parts": ["Hello Traveler"]}
-    ]
-    gsm.update_conversation_history(session_id, history)
+    gsm.append_conversation_turns(session_id, [("user", "Hello Brom"), ("model", "Hello Traveler")])
     print("History added.")
     
     # 5. Simulate "Leave" command flow from main.py
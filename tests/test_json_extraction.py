@@ -0,0 +1,60 @@
+import unittest
+
+from backend.gemini_service import _find_json_span, extract_json_metadata
+
+class TestFindJsonSpan(unittest.TestCase):
+    def test_braces_inside_strings(self):
+        text = 'Hi {"note": "a } and a {", "n": 1} bye'
+        start, end = _find_json_span(text)
+        self.assertEqual(text[start:end], '{"note": "a } and a {", "n": 1}')
+
+    def test_escaped_quotes(self):
+        text = r'{"line": "she said \"}\" loudly", "ok": true}'
+        self.assertEqual(_find_json_span(text), (0, len(text)))
+
+    def test_trailing_text_with_closing_brace(self):
+        text = '{"mood": "calm"} and then a stray }'
+        self.assertEqual(_find_json_span(text), (0, len('{"mood": "calm"}')))
+
+    def test_unclosed_object(self):
+        self.assertIsNone(_find_json_span('Here: {"mood": "calm"'))
+
+    def test_start_position(self):
+        text = '{a} {"b": 1}'
+        self.assertEqual(_find_json_span(text, 3), (4, len(text)))
+
+
+class TestExtractJsonMetadata(unittest.TestCase):
+    def test_plain_text_returned_unchanged(self):
+        self.assertEqual(extract_json_metadata("Just talking."), ("Just talking.", {}))
+
+    def test_fenced_json(self):
+        dialogue, metadata = extract_json_metadata('Hello.\n```json\n{"mood": "happy"}\n```')
+        self.assertEqual(dialogue, "Hello.")
+        self.assertEqual(metadata, {"mood": "happy"})
+
+    def test_fence_without_match_falls_back_to_raw_scan(self):
+        dialogue, metadata = extract_json_metadata('Hello ``` unclosed {"mood": "wary"} end')
+        self.assertEqual(metadata, {"mood": "wary"})
+        self.assertEqual(dialogue, "Hello ``` unclosed  end")
+
+    def test_braces_in_dialogue_before_real_object(self):
+        dialogue, metadata = extract_json_metadata('I found {a clue}. {"mood": "excited"}')
+        self.assertEqual(metadata, {"mood": "excited"})
+        self.assertEqual(dialogue, "I found {a clue}.")
+
+    def test_dialogue_field_wins(self):
+        dialogue, metadata = extract_json_metadata('{"dialogue": "Greetings!", "mood": "happy"}')
+        self.assertEqual(dialogue, "Greetings!")
+        self.assertEqual(metadata["mood"], "happy")
+
+    def test_unclosed_object_is_all_dialogue(self):
+        text = 'Wait {"mood": "calm"'
+        self.assertEqual(extract_json_metadata(text), (text, {}))
+
+    def test_malformed_object_is_all_dialogue(self):
+        text = 'Odd {not json} here'
+        self.assertEqual(extract_json_metadata(text), (text, {}))
+
+if __name__ == '__main__':
+    unittest.main()
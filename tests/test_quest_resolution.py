@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from backend import game_state_manager
+from backend.game_state_manager import GameStateManager, SQL_CLOSE_QUEST
+from backend.game_world import initialize_game_world
+
+# With the default stat of 10, DC 5 always auto-succeeds and DC 25 always auto-fails
+EASY_DC = 5
+IMPOSSIBLE_DC = 25
+
+class TestQuestResolution(unittest.TestCase):
+    def setUp(self):
+        # Each test gets its own database file instead of the committed backend/game_data.db
+        fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        db_patch = patch.object(game_state_manager, "DB_PATH", self.db_path)
+        db_patch.start()
+        self.addCleanup(db_patch.stop)
+        initialize_game_world("Elodia")
+        self.gsm = GameStateManager()
+        self.session_id = "test_quest_resolution"
+        self.gsm.create_session(self.session_id, "TestPlayer")
+
+    def tearDown(self):
+        self.gsm.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def _add_quest(self, quest_id, *dcs):
+        self.gsm.add_quest(self.session_id, {
+            "id": quest_id,
+            "giver_npc": "Elara",
+            "description": f"Quest {quest_id}",
+            "status": "active",
+            "challenges": [
+                {"id": f"{quest_id}_c{i}", "type": "Strength", "dc": dc, "description": f"Challenge {i}"}
+                for i, dc in enumerate(dcs)
+            ],
+        })
+
+    def _quest_status(self, quest_id):
+        with self.gsm._lock:
+            return self.gsm._conn.execute("SELECT status FROM quests WHERE id = ?", (quest_id,)).fetchone()[0]
+
+    def test_resolve_many_closes_quests(self):
+        self._add_quest("rq_pass", EASY_DC, EASY_DC)
+        self._add_quest("rq_fail", EASY_DC, IMPOSSIBLE_DC)
+        self._add_quest("rq_open", EASY_DC, EASY_DC)
+
+        results = self.gsm.resolve_many(self.session_id, [
+            "rq_pass_c0", "rq_pass_c1", "rq_fail_c0", "rq_fail_c1", "rq_open_c0", "missing",
+        ])
+
+        self.assertTrue(results["rq_pass_c0"]["success"])
+        self.assertFalse(results["rq_fail_c1"]["success"])
+        self.assertEqual(results["missing"], {"error": "Challenge not found"})
+        self.assertEqual(self._quest_status("rq_pass"), "completed")
+        self.assertEqual(self._quest_status("rq_fail"), "failed")
+        # One challenge is still open, so the quest stays active
+        self.assertEqual(self._quest_status("rq_open"), "active")
+
+        self.gsm.resolve_challenge(self.session_id, "rq_open_c1")
+        self.assertEqual(self._quest_status("rq_open"), "completed")
+
+    def test_close_quest_skips_unchanged_status(self):
+        self._add_quest("rq_done", EASY_DC)
+        self.gsm.resolve_many(self.session_id, ["rq_done_c0"])
+        self.assertEqual(self._quest_status("rq_done"), "completed")
+        with self.gsm._transaction() as conn:
+            self.assertEqual(conn.execute(SQL_CLOSE_QUEST, {"quest_id": "rq_done"}).rowcount, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import tempfile
+import asyncio
+import threading
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from backend import game_state_manager
+from backend.game_state_manager import GameStateManager, _SessionCache
+from backend.game_world import ARCHITECT, game_world, initialize_game_world
+
+class TestSessionState(unittest.TestCase):
+    def setUp(self):
+        # Each test gets its own database file instead of the committed backend/game_data.db
+        fd, self.db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        db_patch = patch.object(game_state_manager, "DB_PATH", self.db_path)
+        db_patch.start()
+        self.addCleanup(db_patch.stop)
+        initialize_game_world("Elodia")
+        self.gsm = GameStateManager()
+        self.session_id = "test_session_state"
+        self.gsm.create_session(self.session_id, "TestPlayer")
+
+    def tearDown(self):
+        self.gsm.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_session_cache_expiry_and_bound(self):
+        cache = _SessionCache(ttl=60, max_size=2)
+        cache.set("a", {"gold": 1})
+        self.assertEqual(cache.get("a"), {"gold": 1})
+        cache.pop("a")
+        self.assertIsNone(cache.get("a"))
+        expired = _SessionCache(ttl=-1)
+        expired.set("b", {"gold": 2})
+        self.assertIsNone(expired.get("b"))
+        # The least recently used session is dropped once the cache is full
+        cache.set("a", {"gold": 1})
+        cache.set("b", {"gold": 2})
+        cache.get("a")
+        cache.set("c", {"gold": 3})
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+    def test_session_cache_reports_evictions(self):
+        evicted = []
+        cache = _SessionCache(ttl=60, max_size=1, on_evict=evicted.append)
+        cache.set("a", {})
+        cache.set("b", {})
+        cache.pop("b")  # explicit drops are not reported
+        self.assertEqual(evicted, ["a"])
+        expiring = _SessionCache(ttl=-1, on_evict=evicted.append)
+        expiring.set("c", {})
+        self.assertIsNone(expiring.get("c"))
+        self.assertEqual(evicted, ["a", "c"])
+
+    def test_session_cache_write_through(self):
+        self.gsm.set_gold(self.session_id, 42)
+        # Cached copy is updated in place...
+        self.assertEqual(self.gsm.get_gold(self.session_id), 42)
+        # ...and SQLite holds the same value once the cache is dropped
+        self.gsm._invalidate_session(self.session_id)
+        self.assertIsNone(self.gsm._session_cache.get(self.session_id))
+        self.assertEqual(self.gsm.get_gold(self.session_id), 42)
+
+    def test_inventory_rows_survive_cache_drop(self):
+        self.gsm.add_item_to_inventory(self.session_id, "Rope")
+        self.gsm.add_item_to_inventory(self.session_id, "Torch")
+        self.gsm.add_item_to_inventory(self.session_id, "Rope")
+        self.gsm.remove_item_from_inventory(self.session_id, "Rope")
+        self.assertEqual(self.gsm.get_inventory(self.session_id), ["Torch", "Rope"])
+        self.gsm._invalidate_session(self.session_id)
+        self.assertEqual(self.gsm.get_inventory(self.session_id), ["Torch", "Rope"])
+
+    def test_npc_state_written_per_npc(self):
+        self.gsm.update_npc_state(self.session_id, "Elara", {"mood": "wary"})
+        self.gsm._invalidate_session(self.session_id)
+        self.assertEqual(self.gsm.get_npc_state(self.session_id, "Elara")["mood"], "wary")
+
+    def test_conversation_turns_appended(self):
+        self.gsm.append_conversation_turn(self.session_id, "model", "Hello")
+        self.gsm.append_conversation_turns(self.session_id, [("user", "Hi"), ("model", "Well met")])
+        expected = [
+            {"role": "model", "parts": ["Hello"]},
+            {"role": "user", "parts": ["Hi"]},
+            {"role": "model", "parts": ["Well met"]},
+        ]
+        self.assertEqual(self.gsm.get_conversation_history(self.session_id), expected)
+        self.gsm._invalidate_session(self.session_id)
+        self.assertEqual(self.gsm.get_conversation_history(self.session_id), expected)
+        self.gsm.archive_conversation(self.session_id)
+        self.assertEqual(self.gsm.get_conversation_history(self.session_id), [])
+
+    def test_concurrent_appends_keep_every_turn(self):
+        self.gsm.get_conversation_history(self.session_id)  # load the session into the cache
+        def append_many():
+            for _ in range(50):
+                self.gsm.append_conversation_turn(self.session_id, "user", "Hi")
+        threads = [threading.Thread(target=append_many) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.gsm.get_conversation_history(self.session_id)), 200)
+        self.gsm._invalidate_session(self.session_id)
+        self.assertEqual(len(self.gsm.get_conversation_history(self.session_id)), 200)
+
+    def test_close_writes_queued_stubs(self):
+        gsm = GameStateManager()
+        gsm.process_involved_entities(self.session_id, ["close_test_entity"])
+        gsm.close()
+        gsm.close()  # later calls do nothing
+        with self.gsm._transaction() as conn:
+            deleted = conn.execute("DELETE FROM entity_stubs WHERE id = ?", ("close_test_entity",)).rowcount
+        self.assertEqual(deleted, 1)
+
+    def test_world_reload_resyncs_npcs(self):
+        self.gsm.get_npcs_in_location(self.session_id)
+        session = self.gsm._get_session_data(self.session_id)
+        location, x, y = session["current_location_name"], session["player_x"], session["player_y"]
+        # A reloaded world that adds an NPC where the player stands
+        initialize_game_world("Elodia")
+        game_world.add_character(ARCHITECT.model_copy(update={"name": "Test Ghost", "x": x, "y": y}), location)
+        names = [npc["name"] for npc in self.gsm.get_npcs_in_location(self.session_id)]
+        self.assertIn("Test Ghost", names)
+
+    def test_invalidate_drops_npc_name_index(self):
+        self.assertEqual(self.gsm.initiate_dialogue(self.session_id, "the architect"),
+                         "You begin a conversation with The Architect.")
+        self.assertIn(self.session_id, self.gsm._loc_name_index)
+        self.gsm._invalidate_session(self.session_id)
+        self.assertNotIn(self.session_id, self.gsm._loc_name_index)
+
+    def test_stub_ids_loaded_on_first_check(self):
+        with self.gsm._transaction() as conn:
+            conn.execute("INSERT INTO entity_stubs (id, session_id) VALUES (?, ?)", ("known_stub", self.session_id))
+        self.assertNotIn(self.session_id, self.gsm._stub_cache)
+        self.gsm.process_involved_entities(self.session_id, ["known_stub"])
+        self.assertEqual(self.gsm._stub_cache[self.session_id], {"known_stub"})
+        self.assertEqual(self.gsm._stub_queue.unfinished_tasks, 0)
+        self.gsm._invalidate_session(self.session_id)
+        self.assertNotIn(self.session_id, self.gsm._stub_cache)
+
+    def test_examine_picks_first_matching_item(self):
+        self.gsm.add_item_to_inventory(self.session_id, "Magic Sword")
+        self.gsm.add_item_to_inventory(self.session_id, "Sword")
+        with patch.object(game_state_manager, "generate_item_details", AsyncMock(side_effect=lambda item: item)):
+            # Substring match in inventory order, even when a later item matches exactly
+            self.assertEqual(asyncio.run(self.gsm._cmd_examine(self.session_id, "sword")), "Magic Sword")
+            self.assertEqual(asyncio.run(self.gsm._cmd_examine(self.session_id, "SWORD")), "Magic Sword")
+
+    def test_unknown_session_field_rejected(self):
+        with self.assertRaises(ValueError):
+            self.gsm._update_session_field(self.session_id, "session_id = 'x', gold", 1)
+
+if __name__ == '__main__':
+    unittest.main()